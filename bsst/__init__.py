@@ -30,6 +30,7 @@ import time
 import enum
 import types
 import struct
+import operator
 import signal
 import random
 import fnmatch
@@ -43,7 +44,7 @@ from typing import TextIO, Mapping, NamedTuple
 from multiprocessing.pool import AsyncResult
 from copy import deepcopy
 from dataclasses import dataclass
-from functools import total_ordering
+from functools import total_ordering, lru_cache
 from contextlib import contextmanager
 from collections import Counter
 
@@ -792,6 +793,19 @@ class SymEnvironment:
     def do_progressive_z3_checks(self, value: bool) -> None:
         self._do_progressive_z3_checks = value
 
+    @property
+    def always_recheck_at_finalize(self) -> bool:
+        """Always perform Z3 check when finalizing execution path, even
+        if no constraints were added since the last successful check, and
+        no model values are requested for the path. Might be useful for
+        debugging
+        """
+        return self._always_recheck_at_finalize
+
+    @always_recheck_at_finalize.setter
+    def always_recheck_at_finalize(self, value: bool) -> None:
+        self._always_recheck_at_finalize = value
+
     @property
     def tag_data_with_position(self) -> bool:
         """If true, each value pushed on the stack will be tagged with
@@ -1160,6 +1174,7 @@ class SymEnvironment:
         self._max_solver_tries = 100
         self._disable_z3_randomization = False
         self._do_progressive_z3_checks = True
+        self._always_recheck_at_finalize = False
         self._log_progress = True
         self._log_solving_attempts = True
         self._log_solving_attempts_to_stderr = False
@@ -1207,6 +1222,9 @@ class SymEnvironment:
                         Optional[tuple['SymData', int]]], ...]] = []
         self.z3_current_constraints_frame: list[
             tuple['z3.BoolRef', str, Optional[tuple['SymData', int]]]] = []
+        # True when the last check found current constraints satisfiable,
+        # and the constraints did not change since then
+        self.z3_constraints_known_sat = False
 
         self.script_info = ScriptInfo()
 
@@ -1744,6 +1762,9 @@ SCRIPTNUM_DEFAULT_SIZE = 4
 MAX_SCRIPTNUM_INT = 0x7fffffff
 MIN_SCRIPTNUM_INT = -0x7fffffff
 
+# For bytes.translate(), to compute static result of INVERT
+INVERT_BYTES_TABLE = bytes(~b & 0xFF for b in range(256))
+
 SHA256_MAX = 0x1FFFFFFFFFFFFFFF
 
 
@@ -1814,6 +1835,7 @@ g_do_process_data_reference_names = False
 g_current_exec_context: Optional['ExecContext'] = None
 g_current_op: Optional['OpCode'] = None
 g_skip_assertion_for_enforcement_condition: Optional[tuple['SymData', int]] = None
+g_simplified_constraints: Optional[dict[int, tuple['z3.BoolRef', 'z3.BoolRef']]] = None
 g_mode_tags_for_opcodes: Optional[tuple[str, ...]] = None
 g_data_references_to_ignore: set[str] = set()
 g_seen_data_references: set[str] = set()
@@ -2533,6 +2555,7 @@ def z3add(exp: 'z3.BoolRef',  # noqa
         code_exp = (env.get_failure_code() != env.tracked_failure_codes[name])
         assert not isinstance(code_exp, bool), (code_exp, name, None)
         env.z3_current_constraints_frame.append((code_exp, name, None))
+        env.z3_constraints_known_sat = False
         if env.use_z3_incremental_mode:
             z3_solver_add(code_exp, name)
 
@@ -2560,6 +2583,7 @@ def z3add(exp: 'z3.BoolRef',  # noqa
 
     assert not isinstance(exp, bool), (exp, track_name, ecpair)
     env.z3_current_constraints_frame.append((exp, track_name, ecpair))
+    env.z3_constraints_known_sat = False
 
     if env.use_z3_incremental_mode:
         z3_solver_add(z3.simplify(exp), track_name)
@@ -2579,6 +2603,7 @@ def z3_pop_context() -> None:
     if env.z3_enabled:
         env.z3_current_constraints_frame.clear()
         env.z3_current_constraints_frame.extend(env.z3_constraints_stack.pop())
+        env.z3_constraints_known_sat = False
         if env.use_z3_incremental_mode:
             env.get_solver().pop()
 
@@ -2591,6 +2616,46 @@ def IsolatedSolverContext() -> Generator[None, None, None]:
     finally:
         z3_pop_context()
 
+
+@contextmanager
+def SimplifiedConstraintsCache() -> Generator[None, None, None]:
+    """Cache simplified forms of the constraints while in this context,
+    for the case when a number of checks are to be done on top of the
+    same set of constraints, and the solver is reset before each check"""
+
+    global g_simplified_constraints
+
+    assert g_simplified_constraints is None, \
+        "no recursive calls to SimplifiedConstraintsCache"
+
+    g_simplified_constraints = {}
+
+    try:
+        # Populate the cache before any checks are done, so that
+        # the solver processes started for parallel solving inherit it
+        for exp, _, _ in get_current_constraints():
+            simplify_constraint(exp)
+
+        yield
+    finally:
+        g_simplified_constraints = None
+
+
+def simplify_constraint(exp: 'z3.BoolRef') -> 'z3.BoolRef':
+    if g_simplified_constraints is None:
+        return z3.simplify(exp)
+
+    # The cache holds the reference to the original expression, which
+    # means that the id of expression cannot be reused while it is cached,
+    # but we still check the identity to be on the safe side
+    cached = g_simplified_constraints.get(exp.get_id())
+    if cached is None or cached[0] is not exp:
+        cached = (exp, z3.simplify(exp))
+        g_simplified_constraints[exp.get_id()] = cached
+
+    return cached[1]
+
+
 def z3check(  # noqa
     *, force_check: bool = False,
     model_values_to_retrieve: dict[str, tuple[str, SymDataRType]] | None = None
@@ -2644,6 +2709,9 @@ def z3check(  # noqa
 
         return None
 
+    if not g_skip_assertion_for_enforcement_condition:
+        env.z3_constraints_known_sat = True
+
     assert isinstance(model_values_or_fail_reason, dict)
     return model_values_or_fail_reason
 
@@ -2660,7 +2728,7 @@ def _z3check(  # noqa
         for exp, tn, ecpair in get_current_constraints():
             assert not isinstance(exp, bool), (exp, tn, ecpair)
 
-        current_assertions = [(z3.simplify(exp), tn, ecpair)
+        current_assertions = [(simplify_constraint(exp), tn, ecpair)
                               for exp, tn, ecpair in get_current_constraints()]
         if not env.disable_z3_randomization:
             random.shuffle(current_assertions)
@@ -2959,8 +3027,7 @@ def CSHA256_Load(op: 'OpCode', sha256ctx: 'SymData') -> 'CSHA256':
             f'{op.name}: invalid sha256 context')
 
     csha256 = CSHA256()
-    for idx in range(8):
-        csha256.s[idx] = struct.unpack(b'>I', sha256ctx.as_bytes()[idx*4:idx*4+4])[0]
+    csha256.s = list(struct.unpack_from('>8I', sha256ctx.as_bytes()))
 
     csha256.bytes_count = bits >> 3
 
@@ -2992,7 +3059,7 @@ def sym_CSHA256_Load(sha256ctx: 'SymData', bits_load: 'z3.ArithRef',
     # midstate is initial if less than 64 bytes were processed
     Check(Or(bits_load >= 64,
              Extract(sha256ctx.as_ByteSeq(), 0, 32)
-             == IntSeqVal(CSHA256().Midstate())),
+             == IntSeqVal(SHA256_INITIAL_MIDSTATE)),
           err_invalid_sha256_context())
 
 
@@ -3350,7 +3417,7 @@ def add_introspected_scriptpubkey_constraints(
 def add_op_lshift_constraints(
     src: 'z3.SeqSortRef',
     dst: 'z3.SeqSortRef',
-    shift_bits: 'z3.ArithRef',
+    shift_bits: Union[int, 'z3.ArithRef'],
     shift_bytes: 'z3.ArithRef'
 ) -> None:
 
@@ -3373,8 +3440,13 @@ def add_op_lshift_constraints(
     Check(full_bytes == shift_bytes)
     Check(bits == shift_bits)
 
-    bit_scale = pow2_8bit(bits)
-    bit_coscale = pow2_8bit(8-bits)
+    if isinstance(shift_bits, int):
+        # shift amount is known, no need for the If-chain over all 8 values
+        bit_scale = 2**shift_bits
+        bit_coscale = 2**(8-shift_bits)
+    else:
+        bit_scale = pow2_8bit(bits)
+        bit_coscale = pow2_8bit(8-bits)
     src_len = Length(src)
 
     prev_byte_shifted = If(Or(idx < full_bytes + 1, bits == 0),
@@ -3818,6 +3890,8 @@ class ScriptInfo:
     _assertion_positions: dict[int, tuple[BsstAssertion, ...]]
     _assumption_table: dict[str, tuple[BsstAssumption, ...]]
     _name_aliases: dict[str, str]
+    _pos_info_cache: dict[tuple[int, str], str]
+    _pos_repr_cache: dict[int, str]
 
     def __init__(self, *, body: Iterable[OpCode | ScriptData] = (),
                  line_no_table: Iterable[int] = (),
@@ -3832,6 +3906,8 @@ class ScriptInfo:
         self._assertion_positions = {k: tuple(v) for k, v in (assertion_positions or {}).items()}
         self._assumption_table = {k: tuple(v) for k, v in (assumption_table or {}).items()}
         self._name_aliases = {k: v for k, v in (name_aliases or {}).items()}
+        self._pos_info_cache = {}
+        self._pos_repr_cache = {}
 
     def data_reference_at(self, line_no: int) -> str | None:
         return self._data_reference_positions.get(line_no)
@@ -3847,22 +3923,38 @@ class ScriptInfo:
     def name_alias_for(self, name: str) -> Optional[str]:
         return self._name_aliases.get(name)
 
+    def pos_repr(self, pc: int) -> str:
+        r = self._pos_repr_cache.get(pc)
+        if r is None:
+            if pc < len(self.body):
+                r = str(self.body[pc])
+            else:
+                r = 'FINAL_CHECKS'
 
-def op_pos_repr(pc: int) -> str:
-    env = cur_env()
-    if pc < len(env.script_info.body):
-        return str(env.script_info.body[pc])
+            self._pos_repr_cache[pc] = r
 
-    return 'FINAL_CHECKS'
+        return r
 
+    def pos_info(self, pc: int, separator: str = ':') -> str:
+        r = self._pos_info_cache.get((pc, separator))
+        if r is None:
+            if pc >= len(self.body):
+                assert pc == len(self.body)
+                r = 'END'
+            else:
+                r = f'{pc}{separator}L{self.line_no_table[pc]}'
+
+            self._pos_info_cache[(pc, separator)] = r
+
+        return r
+
+
+def op_pos_repr(pc: int) -> str:
+    return cur_env().script_info.pos_repr(pc)
 
-def op_pos_info(pc: int, separator: str = ':') -> str:
-    env = cur_env()
-    if pc >= len(env.script_info.body):
-        assert pc == len(env.script_info.body)
-        return 'END'
 
-    return f'{pc}{separator}L{env.script_info.line_no_table[pc]}'
+def op_pos_info(pc: int, separator: str = ':') -> str:
+    return cur_env().script_info.pos_info(pc, separator)
 
 
 def non_static_value_error(msg: str) -> NoReturn:
@@ -4087,6 +4179,22 @@ class Branchpoint:
 
         self.walk_branches(process_context, is_executing=is_executing)
 
+    def iter_contexts(self, *, include_failed: bool = False
+                      ) -> Generator['ExecContext', None, None]:
+        """Iterate over leaf contexts in the same order as walk_contexts(),
+        but without recursion and without switching the current
+        execution context for each branch. Not to be used while
+        executing, as branches are not allowed to change during iteration
+        """
+        stack: list['Branchpoint'] = [self]
+        while stack:
+            bp = stack.pop()
+            if bp._branches:
+                stack.extend(reversed(bp._branches))
+            elif bp.context:
+                if not bp.context.failure or include_failed:
+                    yield bp.context
+
     def process_always_true_enforcements(self) -> None:
         known_enforcements: dict[int, list[tuple[Enforcement, str]]] = {}
 
@@ -5445,10 +5553,14 @@ class ExecContext(SupportsFailureCodeCallbacks):
         env = cur_env()
         with CurrentExecContext(self):
             result: list[tuple['SymData', str]] = []
-            for i, val in enumerate(reversed(self.stack)):
+            stack = self.stack
+            stack_len = len(stack)
+            use_positions = not env.cleanstack_flag or stack_len > 1
+            for pos in range(-1, -stack_len-1, -1):
+                val = stack[pos]
                 maybe_val = f' = {val}' if val._name else ''
-                if not env.cleanstack_flag or len(self.stack) > 1:
-                    name = f'stack[{-(i+1)}]{maybe_val}'
+                if use_positions:
+                    name = f'stack[{pos}]{maybe_val}'
                 else:
                     name = f'{SCRIPT_RESULT_SPECIAL_MVNAME}{maybe_val}'
 
@@ -7405,28 +7517,10 @@ def _symex_op(ctx: ExecContext, op_or_sd: OpCode | ScriptData  # noqa
 
             if isinstance(full_bits, int):
                 if vch1.is_static:
-                    data = vch1.as_bytes()
-
-                    bits = full_bits % 8
-
-                    if full_bytes >= len(data):
-                        r.set_static(b'')
-                    else:
-                        r_bdata = bytearray(data[full_bytes:])
-
-                        temp = 0
-                        for i in range(len(r_bdata)-1, -1, -1):
-                            temp = (r_bdata[i] << (8 - bits)) | ((temp << 8) & 0xff00)
-                            r_bdata[i] = (temp & 0xff00) >> 8
-
-                        # 0x0fff >> 4 == 0x00ff or 0xff, reduce to minimal representation
-                        for i in range(len(r_bdata)-1, -1, -1):
-                            if r_bdata[i] != 0:
-                                break
-
-                            r_bdata = r_bdata[:i]
-
-                        r.set_static(r_bdata)
+                    value = int.from_bytes(vch1.as_bytes(), 'little') >> full_bits
+                    # 0x0fff >> 4 == 0x00ff or 0xff, reduce to minimal representation
+                    r.set_static(value.to_bytes((value.bit_length() + 7) // 8,
+                                                'little'))
 
             if not r.is_static:
                 data = vch1.use_as_ByteSeq()
@@ -7471,23 +7565,10 @@ def _symex_op(ctx: ExecContext, op_or_sd: OpCode | ScriptData  # noqa
 
             if isinstance(full_bits, int):
                 if vch1.is_static:
-                    data = vch1.as_bytes()
-
-                    r_data = bytearray((b'\x00'*full_bytes) + data + b'\x00')
-
-                    temp = 0
-                    for i in range(len(r_data)):
-                        temp = (r_data[i] << bits) | (temp >> 8)
-                        r_data[i] = temp & 0xff
-
+                    value = int.from_bytes(vch1.as_bytes(), 'little') << full_bits
                     # reduce to minimal representation
-                    for i in range(len(r_data)-1, -1, -1):
-                        if r_data[i] != 0:
-                            break
-
-                        r_data = r_data[:i]
-
-                    r.set_static(r_data)
+                    r.set_static(value.to_bytes((value.bit_length() + 7) // 8,
+                                                'little'))
 
             if not r.is_static:
                 add_op_lshift_constraints(
@@ -7509,11 +7590,7 @@ def _symex_op(ctx: ExecContext, op_or_sd: OpCode | ScriptData  # noqa
             r = symresult(op, vch1)
 
             if vch1.is_static:
-                r_data_static = bytearray(vch1.as_bytes())
-                for i in range(len(r_data_static)):
-                    r_data_static[i] = ~r_data_static[i] & 0xFF
-
-                r.set_static(r_data_static)
+                r.set_static(vch1.as_bytes().translate(INVERT_BYTES_TABLE))
             elif env.z3_enabled:
                 idx = FreshInt('idx')
                 data = vch1.use_as_ByteSeq()
@@ -7544,18 +7621,21 @@ def _symex_op(ctx: ExecContext, op_or_sd: OpCode | ScriptData  # noqa
             Check(vch1.Length() == vch2.Length(), err_length_mismatch())
 
             if vch1.is_static and vch2.is_static:
-                r_bdata = bytearray(vch1.as_bytes())
-                vch2_data = vch2.as_bytes()
-
-                for i in range(len(r_bdata)):
-                    if op == OP_AND:
-                        r_bdata[i] &= vch2_data[i]
-                    elif op == OP_OR:
-                        r_bdata[i] |= vch2_data[i]
-                    elif op == OP_XOR:
-                        r_bdata[i] ^= vch2_data[i]
-
-                r.set_static(r_bdata)
+                # Lengths are equal here, otherwise the check above would
+                # have failed. Operate on whole values rather than per byte
+                vch1_data = vch1.as_bytes()
+                v1 = int.from_bytes(vch1_data, 'little')
+                v2 = int.from_bytes(vch2.as_bytes(), 'little')
+
+                if op == OP_AND:
+                    rv = v1 & v2
+                elif op == OP_OR:
+                    rv = v1 | v2
+                else:
+                    assert op == OP_XOR
+                    rv = v1 ^ v2
+
+                r.set_static(rv.to_bytes(len(vch1_data), 'little'))
             elif vch1.is_static:
                 vch2.set_possible_sizes(len(vch1.as_bytes()))
             elif vch2.is_static:
@@ -7792,19 +7872,12 @@ def _symex_op(ctx: ExecContext, op_or_sd: OpCode | ScriptData  # noqa
 
             r = symresult(op, vch)
 
-            hf_table: dict[str, Callable[[bytes], bytes]] = {
-                'RIPEMD160': lambda v: ripemd160(v),
-                'SHA1': lambda v: hashlib.sha1(v).digest(),
-                'SHA256': lambda v: hashlib.sha256(v).digest(),
-                'HASH160': lambda v: ripemd160(hashlib.sha256(v).digest()),
-                'HASH256': lambda v: hashlib.sha256(
-                    hashlib.sha256(v).digest()).digest()
-            }
+            hash_fun, digest_size = HASH_OPCODE_FUNCTIONS[op.name]
 
             if vch.is_static:
-                r.set_static(hf_table[op.name](vch.as_bytes()))
+                r.set_static(hash_fun(vch.as_bytes()))
             else:
-                r.set_possible_sizes(len(hf_table[op.name](b'')))
+                r.set_possible_sizes(digest_size)
 
             if env.z3_enabled:
                 sym_fun, collision_possible = env.get_sym_hashfun(op)
@@ -8212,7 +8285,7 @@ def _symex_op(ctx: ExecContext, op_or_sd: OpCode | ScriptData  # noqa
                 # if data length is less than 64, the midstate will be initial
                 Check(Implies(datalen < 64,
                               Extract(r_data, 0, 32)
-                              == IntSeqVal(CSHA256().Midstate())))
+                              == IntSeqVal(SHA256_INITIAL_MIDSTATE)))
 
             z3check()
 
@@ -8265,7 +8338,7 @@ def _symex_op(ctx: ExecContext, op_or_sd: OpCode | ScriptData  # noqa
                 # if data length is less than 64, the midstate will be initial
                 Check(Implies(datalen < 64,
                               Extract(r_data, 0, 32)
-                              == IntSeqVal(CSHA256().Midstate())))
+                              == IntSeqVal(SHA256_INITIAL_MIDSTATE)))
 
             z3check()
 
@@ -9347,7 +9420,7 @@ def parse_script_data(text: str, *, die: Callable[[str], NoReturn],  # noqa
                           do_check_non_minimal=env.minimaldata_flag_strict)
 
     if env.is_elements and \
-            text.lower().startswith('le64(') and text.endswith(')'):
+            text[:5].lower() == 'le64(' and text.endswith(')'):
 
         text = text[5:-1]
 
@@ -9386,7 +9459,7 @@ def parse_script_data(text: str, *, die: Callable[[str], NoReturn],  # noqa
 
         return ScriptData(name=None, value=v)
 
-    if text.lower().startswith("x('") and text.endswith("')"):
+    if text[:3] in ("x('", "X('") and text.endswith("')"):
         data_str = text[3:-2]
         try:
             return ScriptData(
@@ -9395,7 +9468,7 @@ def parse_script_data(text: str, *, die: Callable[[str], NoReturn],  # noqa
         except ValueError:
             die(f'cannot decode data: {data_str}')
 
-    if text.lower().startswith("0x"):
+    if text[:2] in ('0x', '0X'):
         data_str = text[2:]
         try:
             return ScriptData(
@@ -9645,6 +9718,51 @@ def finalize(ctx: ExecContext) -> None:  # noqa
     env.call_post_finalize_hooks(ctx)
 
 
+def _iter_finalize_values(ctx: ExecContext, env: SymEnvironment
+                          ) -> Generator[tuple[SymData, str, int], None, None]:
+    """Yield the values that model value samples are requested for,
+    together with their names and the number of samples. Each value
+    is yielded only once, even if it is reachable by several names"""
+
+    seen: set[SymData] = set()
+
+    for wit in ctx.used_witnesses:
+        assert wit.name
+        if num_samples := env.model_values_name_match(wit.name):
+            seen.add(wit)
+            yield wit, wit.name, num_samples
+
+    for txval in ctx.tx.values():
+        assert txval not in seen, \
+            ("only witnesses are processed at this point, tx values"
+                "cannot intersect")
+        assert txval.name
+        num_samples = (env.model_values_name_match('tx')
+                       or env.model_values_name_match(f'{txval}'))
+        if num_samples:
+            seen.add(txval)
+            yield txval, f'{txval}', num_samples
+
+    for val in env.data_placeholders.values():
+        if val not in seen:
+            assert val.name
+            if num_samples := env.model_values_name_match(val.name):
+                seen.add(val)
+                yield val, val.name, num_samples
+
+    for dref_name, (dr_for_global, dref) in ctx.data_references.items():
+        if dref not in seen:
+            if num_samples := env.model_values_name_match(f'&{dref_name}'):
+                seen.add(dref)
+                yield dref, f'&{dr_for_global}', num_samples
+
+    if num_samples := env.model_values_name_match('stack'):
+        for val, name in ctx.get_stack_values_with_names():
+            if val not in seen:
+                seen.add(val)
+                yield val, name, num_samples
+
+
 def _finalize(ctx: ExecContext, env: SymEnvironment) -> None:  # noqa
     assert not ctx.failure
     assert ctx.pc == len(env.script_info.body)
@@ -9712,46 +9830,10 @@ def _finalize(ctx: ExecContext, env: SymEnvironment) -> None:  # noqa
     mvnamemap: dict[str, 'SymData'] = {}
     processed_mv: dict[SymData, str] = {}
     if env.produce_model_values:
-        for wit in ctx.used_witnesses:
-            assert wit.name
-            if num_samples := env.model_values_name_match(wit.name):
-                wit.update_model_values_request_dict(mvdict_req, mvnamemap)
-                wit.num_model_value_samples = num_samples
-                processed_mv[wit] = wit.name
-
-        for txval in ctx.tx.values():
-            assert txval not in processed_mv, \
-                ("only witnesses are processed at this point, tx values"
-                    "cannot intersect")
-            assert txval.name
-            num_samples = (env.model_values_name_match('tx')
-                           or env.model_values_name_match(f'{txval}'))
-            if num_samples:
-                txval.update_model_values_request_dict(mvdict_req, mvnamemap)
-                txval.num_model_value_samples = num_samples
-                processed_mv[txval] = f'{txval}'
-
-        for val in env.data_placeholders.values():
-            if val not in processed_mv:
-                assert val.name
-                if num_samples := env.model_values_name_match(val.name):
-                    val.update_model_values_request_dict(mvdict_req, mvnamemap)
-                    val.num_model_value_samples = num_samples
-                    processed_mv[val] = val.name
-
-        for dref_name, (dr_for_global, dref) in ctx.data_references.items():
-            if dref not in processed_mv:
-                if num_samples := env.model_values_name_match(f'&{dref_name}'):
-                    dref.update_model_values_request_dict(mvdict_req, mvnamemap)
-                    dref.num_model_value_samples = num_samples
-                    processed_mv[dref] = f'&{dr_for_global}'
-
-        if num_samples := env.model_values_name_match('stack'):
-            for val, name in ctx.get_stack_values_with_names():
-                if val not in processed_mv:
-                    val.update_model_values_request_dict(mvdict_req, mvnamemap)
-                    val.num_model_value_samples = num_samples
-                    processed_mv[val] = name
+        for val, name, num_samples in _iter_finalize_values(ctx, env):
+            val.update_model_values_request_dict(mvdict_req, mvnamemap)
+            val.num_model_value_samples = num_samples
+            processed_mv[val] = name
 
         assert len(processed_mv.keys()) == len(set(processed_mv.values())), \
             "no duplicate names expected"
@@ -9763,8 +9845,14 @@ def _finalize(ctx: ExecContext, env: SymEnvironment) -> None:  # noqa
             level=1, is_solving=True, no_empty_line_above=True)
 
     try:
-        mvdict = z3check(force_check=True,
-                         model_values_to_retrieve=mvdict_req)
+        if not mvdict_req and env.z3_constraints_known_sat and \
+                not env.always_recheck_at_finalize:
+            # Nothing changed since the last successful check, and
+            # there are no model values to retrieve
+            mvdict = {}
+        else:
+            mvdict = z3check(force_check=True,
+                             model_values_to_retrieve=mvdict_req)
     except ScriptFailure as sf:
         if env.log_progress:
             env.ensure_empty_line()
@@ -9827,24 +9915,30 @@ def _finalize(ctx: ExecContext, env: SymEnvironment) -> None:  # noqa
                 print_as_header('Checking for always-true enforcements',
                                 level=2, is_solving=True)
 
-            for e in verify_targets:
-                global g_skip_assertion_for_enforcement_condition
-                g_skip_assertion_for_enforcement_condition = (e.cond, e.pc)
+            global g_skip_assertion_for_enforcement_condition
 
-                try:
-                    ename = f'{e.cond} @ {op_pos_info(e.pc)}'
-                    if e.is_script_bool:
-                        cond_to_check = (use_as_script_bool(e.cond) == 0)
-                    else:
-                        assert e.cond.was_used_as_Int, \
-                            "e.cond expected to be from EQUALVERIFY or NUMEQUALVERIFY"
-                        cond_to_check = (e.cond.as_Int() == 0)
+            # All the checks below are done against the same constraints
+            # of the path, except for the condition being checked and
+            # the assertions that are skipped for it
+            with SimplifiedConstraintsCache():
+                for e in verify_targets:
+                    g_skip_assertion_for_enforcement_condition = (e.cond, e.pc)
+
+                    try:
+                        ename = f'{e.cond} @ {op_pos_info(e.pc)}'
+                        if e.is_script_bool:
+                            cond_to_check = (use_as_script_bool(e.cond) == 0)
+                        else:
+                            assert e.cond.was_used_as_Int, \
+                                "e.cond expected to be from EQUALVERIFY or NUMEQUALVERIFY"
+                            cond_to_check = (e.cond.as_Int() == 0)
 
-                    if not is_cond_possible(cond_to_check, e.cond, name=ename,
-                                            fail_msg='  - always true'):
-                        e.is_always_true_in_path = True
-                finally:
-                    g_skip_assertion_for_enforcement_condition = None
+                        if not is_cond_possible(cond_to_check, e.cond,
+                                                name=ename,
+                                                fail_msg='  - always true'):
+                            e.is_always_true_in_path = True
+                    finally:
+                        g_skip_assertion_for_enforcement_condition = None
 
     ctx.model_value_repr_dict[NUM_WITNESSES_SPECIAL_MVNAME] = {
         MVINFO_TYPE_VALUE: ModelValueInfo(
@@ -9883,11 +9977,13 @@ def print_as_header(lines_or_str: str | Iterable[str], level: int = 0,
     if level > 2:
         raise ValueError('unsupported header level')
 
-    lines: Iterable[str]
+    lines: list[str]
     if isinstance(lines_or_str, str):
         lines = lines_or_str.split('\n')
     else:
-        lines = lines_or_str
+        # lines_or_str may be a single-use iterator, and we need to
+        # traverse the lines more than once
+        lines = list(lines_or_str)
 
     chtop, chbottom = {0: ('=', '='), 1: (None, '-'), 2: (None, '~')}[level]
 
@@ -9896,23 +9992,25 @@ def print_as_header(lines_or_str: str | Iterable[str], level: int = 0,
     if not no_empty_line_above:
         env.ensure_empty_line()
 
-    max_ll = max(len(ln) for ln in lines) if lines else 0
-    if chtop:
-        env.write_line(chtop*max_ll)
-    env.write_line('\n'.join(lines))
-    if chbottom:
-        env.write_line(chbottom*max_ll)
+    max_ll = max(map(len, lines), default=0)
+    top_bar = chtop*max_ll if chtop else None
+    bottom_bar = chbottom*max_ll if chbottom else None
+    body = '\n'.join(lines)
 
-    env = cur_env()
+    if top_bar is not None:
+        env.write_line(top_bar)
+    env.write_line(body)
+    if bottom_bar is not None:
+        env.write_line(bottom_bar)
 
     if is_solving and env.log_solving_attempts_to_stderr:
         if not no_empty_line_above:
             env.solving_log_ensure_empty_line()
-        if chtop:
-            env.solving_log_line(chtop*max_ll)
-        env.solving_log_line('\n'.join(lines))
-        if chbottom:
-            env.solving_log_line(chbottom*max_ll)
+        if top_bar is not None:
+            env.solving_log_line(top_bar)
+        env.solving_log_line(body)
+        if bottom_bar is not None:
+            env.solving_log_line(bottom_bar)
 
 
 def report() -> None:  # noqa
@@ -10025,7 +10123,7 @@ def report() -> None:  # noqa
                 print_as_header("All valid paths:", level=1)
 
             enflist = list(enforcements_by_path[path])
-            enflist.sort(key=lambda bp: bp.pc)
+            enflist.sort(key=operator.attrgetter('pc'))
 
             env.ensure_empty_line()
 
@@ -10345,6 +10443,35 @@ def report() -> None:  # noqa
     env.call_report_end_hooks()
 
 
+# SHA-256 round constants
+SHA256_K = (
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5,
+    0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3,
+    0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc,
+    0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7,
+    0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13,
+    0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3,
+    0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5,
+    0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208,
+    0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+)
+
+# SHA-256 initial state
+SHA256_INITIAL_STATE = (
+    0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+    0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+)
+
+# Midstate of SHA-256 before any data was processed
+SHA256_INITIAL_MIDSTATE = struct.pack('>8I', *SHA256_INITIAL_STATE)
+
 T_CSHA256 = TypeVar('T_CSHA256', bound='CSHA256')
 
 
@@ -10410,194 +10537,58 @@ class CSHA256():
     def __init__(self) -> None:
         self.Reset()
 
-    # Perform a number of SHA-256 transformations, processing 64-byte chunks.
-    def Transform(self, chunk: Union[bytes, bytearray], blocks: int) -> None:  # noqa
+    # Perform a number of SHA-256 transformations, processing 64-byte chunks,
+    # starting at the given offset in the chunk.
+    def Transform(self, chunk: Union[bytes, bytearray], blocks: int,
+                  offset: int = 0) -> None:
         if not isinstance(blocks, int):
             raise TypeError('blocks must be an instance of int')
         if not isinstance(chunk, (bytes, bytearray)):
             raise TypeError('chunk must be an instance of bytes or bytearray')
 
-        def uint32(x: int) -> int:
-            return x & 0xFFFFFFFF
-
-        def sigma0(x: int) -> int:
-            return (x >> 7 | x << 25) ^ (x >> 18 | x << 14) ^ (x >> 3)
-
-        def sigma1(x: int) -> int:
-            return (x >> 17 | x << 15) ^ (x >> 19 | x << 13) ^ (x >> 10)
-
-        def ReadBE32(buf: bytes) -> int:
-            return int(struct.unpack(b">I", buf[:4])[0])
-
-        def Round(a: int, b: int, c: int, d: int, e: int, f: int, g: int, h: int,
-                  k: int, w: int, x: list[int]) -> None:
-
-            def uint32(x: int) -> int:
-                return x & 0xFFFFFFFF
-
-            def Maj(x: int, y: int, z: int) -> int:
-                return (x & y) | (z & (x | y))
-
-            def Ch(x: int, y: int, z: int) -> int:
-                return z ^ (x & (y ^ z))
-
-            def Sigma1(x: int) -> int:
-                return (x >> 6 | x << 26) ^ (x >> 11 | x << 21) ^ (x >> 25 | x << 7)
-
-            def Sigma0(x: int) -> int:
-                return (x >> 2 | x << 30) ^ (x >> 13 | x << 19) ^ (x >> 22 | x << 10)
-
-            t1 = uint32(x[h] + Sigma1(x[e]) + Ch(x[e], x[f], x[g]) + k + w)
-            t2 = uint32(Sigma0(x[a]) + Maj(x[a], x[b], x[c]))
-            x[d] = uint32(x[d] + t1)
-            x[h] = uint32(t1 + t2)
-
         s = self.s
+        w = [0] * 64
         while blocks:
             blocks -= 1
-            a, b, c, d, e, f, g, h = range(8)
-            x = s.copy()
-
-            w0 = ReadBE32(chunk[0:])
-            Round(a, b, c, d, e, f, g, h, 0x428a2f98, w0, x)
-            w1 = ReadBE32(chunk[4:])
-            Round(h, a, b, c, d, e, f, g, 0x71374491, w1, x)
-            w2 = ReadBE32(chunk[8:])
-            Round(g, h, a, b, c, d, e, f, 0xb5c0fbcf, w2, x)
-            w3 = ReadBE32(chunk[12:])
-            Round(f, g, h, a, b, c, d, e, 0xe9b5dba5, w3, x)
-            w4 = ReadBE32(chunk[16:])
-            Round(e, f, g, h, a, b, c, d, 0x3956c25b, w4, x)
-            w5 = ReadBE32(chunk[20:])
-            Round(d, e, f, g, h, a, b, c, 0x59f111f1, w5, x)
-            w6 = ReadBE32(chunk[24:])
-            Round(c, d, e, f, g, h, a, b, 0x923f82a4, w6, x)
-            w7 = ReadBE32(chunk[28:])
-            Round(b, c, d, e, f, g, h, a, 0xab1c5ed5, w7, x)
-            w8 = ReadBE32(chunk[32:])
-            Round(a, b, c, d, e, f, g, h, 0xd807aa98, w8, x)
-            w9 = ReadBE32(chunk[36:])
-            Round(h, a, b, c, d, e, f, g, 0x12835b01, w9, x)
-            w10 = ReadBE32(chunk[40:])
-            Round(g, h, a, b, c, d, e, f, 0x243185be, w10, x)
-            w11 = ReadBE32(chunk[44:])
-            Round(f, g, h, a, b, c, d, e, 0x550c7dc3, w11, x)
-            w12 = ReadBE32(chunk[48:])
-            Round(e, f, g, h, a, b, c, d, 0x72be5d74, w12, x)
-            w13 = ReadBE32(chunk[52:])
-            Round(d, e, f, g, h, a, b, c, 0x80deb1fe, w13, x)
-            w14 = ReadBE32(chunk[56:])
-            Round(c, d, e, f, g, h, a, b, 0x9bdc06a7, w14, x)
-            w15 = ReadBE32(chunk[60:])
-            Round(b, c, d, e, f, g, h, a, 0xc19bf174, w15, x)
-
-            w0 = uint32(w0 + sigma1(w14) + w9 + sigma0(w1))
-            Round(a, b, c, d, e, f, g, h, 0xe49b69c1, w0, x)
-            w1 = uint32(w1 + sigma1(w15) + w10 + sigma0(w2))
-            Round(h, a, b, c, d, e, f, g, 0xefbe4786, w1, x)
-            w2 = uint32(w2 + sigma1(w0) + w11 + sigma0(w3))
-            Round(g, h, a, b, c, d, e, f, 0x0fc19dc6, w2, x)
-            w3 = uint32(w3 + sigma1(w1) + w12 + sigma0(w4))
-            Round(f, g, h, a, b, c, d, e, 0x240ca1cc, w3, x)
-            w4 = uint32(w4 + sigma1(w2) + w13 + sigma0(w5))
-            Round(e, f, g, h, a, b, c, d, 0x2de92c6f, w4, x)
-            w5 = uint32(w5 + sigma1(w3) + w14 + sigma0(w6))
-            Round(d, e, f, g, h, a, b, c, 0x4a7484aa, w5, x)
-            w6 = uint32(w6 + sigma1(w4) + w15 + sigma0(w7))
-            Round(c, d, e, f, g, h, a, b, 0x5cb0a9dc, w6, x)
-            w7 = uint32(w7 + sigma1(w5) + w0 + sigma0(w8))
-            Round(b, c, d, e, f, g, h, a, 0x76f988da, w7, x)
-            w8 = uint32(w8 + sigma1(w6) + w1 + sigma0(w9))
-            Round(a, b, c, d, e, f, g, h, 0x983e5152, w8, x)
-            w9 = uint32(w9 + sigma1(w7) + w2 + sigma0(w10))
-            Round(h, a, b, c, d, e, f, g, 0xa831c66d, w9, x)
-            w10 = uint32(w10 + sigma1(w8) + w3 + sigma0(w11))
-            Round(g, h, a, b, c, d, e, f, 0xb00327c8, w10, x)
-            w11 = uint32(w11 + sigma1(w9) + w4 + sigma0(w12))
-            Round(f, g, h, a, b, c, d, e, 0xbf597fc7, w11, x)
-            w12 = uint32(w12 + sigma1(w10) + w5 + sigma0(w13))
-            Round(e, f, g, h, a, b, c, d, 0xc6e00bf3, w12, x)
-            w13 = uint32(w13 + sigma1(w11) + w6 + sigma0(w14))
-            Round(d, e, f, g, h, a, b, c, 0xd5a79147, w13, x)
-            w14 = uint32(w14 + sigma1(w12) + w7 + sigma0(w15))
-            Round(c, d, e, f, g, h, a, b, 0x06ca6351, w14, x)
-            w15 = uint32(w15 + sigma1(w13) + w8 + sigma0(w0))
-            Round(b, c, d, e, f, g, h, a, 0x14292967, w15, x)
-
-            w0 = uint32(w0 + sigma1(w14) + w9 + sigma0(w1))
-            Round(a, b, c, d, e, f, g, h, 0x27b70a85, w0, x)
-            w1 = uint32(w1 + sigma1(w15) + w10 + sigma0(w2))
-            Round(h, a, b, c, d, e, f, g, 0x2e1b2138, w1, x)
-            w2 = uint32(w2 + sigma1(w0) + w11 + sigma0(w3))
-            Round(g, h, a, b, c, d, e, f, 0x4d2c6dfc, w2, x)
-            w3 = uint32(w3 + sigma1(w1) + w12 + sigma0(w4))
-            Round(f, g, h, a, b, c, d, e, 0x53380d13, w3, x)
-            w4 = uint32(w4 + sigma1(w2) + w13 + sigma0(w5))
-            Round(e, f, g, h, a, b, c, d, 0x650a7354, w4, x)
-            w5 = uint32(w5 + sigma1(w3) + w14 + sigma0(w6))
-            Round(d, e, f, g, h, a, b, c, 0x766a0abb, w5, x)
-            w6 = uint32(w6 + sigma1(w4) + w15 + sigma0(w7))
-            Round(c, d, e, f, g, h, a, b, 0x81c2c92e, w6, x)
-            w7 = uint32(w7 + sigma1(w5) + w0 + sigma0(w8))
-            Round(b, c, d, e, f, g, h, a, 0x92722c85, w7, x)
-            w8 = uint32(w8 + sigma1(w6) + w1 + sigma0(w9))
-            Round(a, b, c, d, e, f, g, h, 0xa2bfe8a1, w8, x)
-            w9 = uint32(w9 + sigma1(w7) + w2 + sigma0(w10))
-            Round(h, a, b, c, d, e, f, g, 0xa81a664b, w9, x)
-            w10 = uint32(w10 + sigma1(w8) + w3 + sigma0(w11))
-            Round(g, h, a, b, c, d, e, f, 0xc24b8b70, w10, x)
-            w11 = uint32(w11 + sigma1(w9) + w4 + sigma0(w12))
-            Round(f, g, h, a, b, c, d, e, 0xc76c51a3, w11, x)
-            w12 = uint32(w12 + sigma1(w10) + w5 + sigma0(w13))
-            Round(e, f, g, h, a, b, c, d, 0xd192e819, w12, x)
-            w13 = uint32(w13 + sigma1(w11) + w6 + sigma0(w14))
-            Round(d, e, f, g, h, a, b, c, 0xd6990624, w13, x)
-            w14 = uint32(w14 + sigma1(w12) + w7 + sigma0(w15))
-            Round(c, d, e, f, g, h, a, b, 0xf40e3585, w14, x)
-            w15 = uint32(w15 + sigma1(w13) + w8 + sigma0(w0))
-            Round(b, c, d, e, f, g, h, a, 0x106aa070, w15, x)
-
-            w0 = uint32(w0 + sigma1(w14) + w9 + sigma0(w1))
-            Round(a, b, c, d, e, f, g, h, 0x19a4c116, w0, x)
-            w1 = uint32(w1 + sigma1(w15) + w10 + sigma0(w2))
-            Round(h, a, b, c, d, e, f, g, 0x1e376c08, w1, x)
-            w2 = uint32(w2 + sigma1(w0) + w11 + sigma0(w3))
-            Round(g, h, a, b, c, d, e, f, 0x2748774c, w2, x)
-            w3 = uint32(w3 + sigma1(w1) + w12 + sigma0(w4))
-            Round(f, g, h, a, b, c, d, e, 0x34b0bcb5, w3, x)
-            w4 = uint32(w4 + sigma1(w2) + w13 + sigma0(w5))
-            Round(e, f, g, h, a, b, c, d, 0x391c0cb3, w4, x)
-            w5 = uint32(w5 + sigma1(w3) + w14 + sigma0(w6))
-            Round(d, e, f, g, h, a, b, c, 0x4ed8aa4a, w5, x)
-            w6 = uint32(w6 + sigma1(w4) + w15 + sigma0(w7))
-            Round(c, d, e, f, g, h, a, b, 0x5b9cca4f, w6, x)
-            w7 = uint32(w7 + sigma1(w5) + w0 + sigma0(w8))
-            Round(b, c, d, e, f, g, h, a, 0x682e6ff3, w7, x)
-            w8 = uint32(w8 + sigma1(w6) + w1 + sigma0(w9))
-            Round(a, b, c, d, e, f, g, h, 0x748f82ee, w8, x)
-            w9 = uint32(w9 + sigma1(w7) + w2 + sigma0(w10))
-            Round(h, a, b, c, d, e, f, g, 0x78a5636f, w9, x)
-            w10 = uint32(w10 + sigma1(w8) + w3 + sigma0(w11))
-            Round(g, h, a, b, c, d, e, f, 0x84c87814, w10, x)
-            w11 = uint32(w11 + sigma1(w9) + w4 + sigma0(w12))
-            Round(f, g, h, a, b, c, d, e, 0x8cc70208, w11, x)
-            w12 = uint32(w12 + sigma1(w10) + w5 + sigma0(w13))
-            Round(e, f, g, h, a, b, c, d, 0x90befffa, w12, x)
-            w13 = uint32(w13 + sigma1(w11) + w6 + sigma0(w14))
-            Round(d, e, f, g, h, a, b, c, 0xa4506ceb, w13, x)
-            Round(c, d, e, f, g, h, a, b, 0xbef9a3f7, w14 + sigma1(w12) + w7 + sigma0(w15), x)
-            Round(b, c, d, e, f, g, h, a, 0xc67178f2, w15 + sigma1(w13) + w8 + sigma0(w0), x)
-
-            s[0] = uint32(s[0] + x[a])
-            s[1] = uint32(s[1] + x[b])
-            s[2] = uint32(s[2] + x[c])
-            s[3] = uint32(s[3] + x[d])
-            s[4] = uint32(s[4] + x[e])
-            s[5] = uint32(s[5] + x[f])
-            s[6] = uint32(s[6] + x[g])
-            s[7] = uint32(s[7] + x[h])
-
-            chunk = chunk[64:]
+
+            w[:16] = struct.unpack_from('>16I', chunk, offset)
+            offset += 64
+
+            for r in range(16, 64):
+                x = w[r-15]
+                sigma0 = (x >> 7 | x << 25) ^ (x >> 18 | x << 14) ^ (x >> 3)
+                x = w[r-2]
+                sigma1 = (x >> 17 | x << 15) ^ (x >> 19 | x << 13) ^ (x >> 10)
+                w[r] = (w[r-16] + sigma0 + w[r-7] + sigma1) & 0xFFFFFFFF
+
+            a, b, c, d, e, f, g, h = s
+
+            for k, wr in zip(SHA256_K, w):
+                Sigma1 = ((e >> 6 | e << 26) ^ (e >> 11 | e << 21)
+                          ^ (e >> 25 | e << 7))
+                Ch = g ^ (e & (f ^ g))
+                t1 = (h + Sigma1 + Ch + k + wr) & 0xFFFFFFFF
+                Sigma0 = ((a >> 2 | a << 30) ^ (a >> 13 | a << 19)
+                          ^ (a >> 22 | a << 10))
+                Maj = (a & b) | (c & (a | b))
+                t2 = (Sigma0 + Maj) & 0xFFFFFFFF
+                h = g
+                g = f
+                f = e
+                e = (d + t1) & 0xFFFFFFFF
+                d = c
+                c = b
+                b = a
+                a = (t1 + t2) & 0xFFFFFFFF
+
+            s[0] = (s[0] + a) & 0xFFFFFFFF
+            s[1] = (s[1] + b) & 0xFFFFFFFF
+            s[2] = (s[2] + c) & 0xFFFFFFFF
+            s[3] = (s[3] + d) & 0xFFFFFFFF
+            s[4] = (s[4] + e) & 0xFFFFFFFF
+            s[5] = (s[5] + f) & 0xFFFFFFFF
+            s[6] = (s[6] + g) & 0xFFFFFFFF
+            s[7] = (s[7] + h) & 0xFFFFFFFF
 
     def Write(self: T_CSHA256, data: Union[bytes, bytearray]) -> T_CSHA256:
         if not isinstance(data, (bytes, bytearray)):
@@ -10606,29 +10597,32 @@ class CSHA256():
         if self.bytes_count + len(data) > SHA256_MAX:
             raise ValueError('total bytes count beyond max allowed value')
 
+        # The data is not sliced as it is processed, to avoid copying it
+        # again and again, instead the position in the data is tracked
+        pos = 0
         bufsize = self.bytes_count % 64
         assert len(self.buf) == bufsize
         if bufsize and bufsize + len(data) >= 64:
             # Fill the buffer, and process it.
             remainder_len = 64 - bufsize
             buf = self.buf + data[:remainder_len]
-            data = data[remainder_len:]
+            pos = remainder_len
             self.bytes_count += remainder_len
             self.Transform(buf, 1)
             self.buf = b''
             bufsize = 0
 
-        if len(data) >= 64:
-            blocks = len(data) // 64
-            self.Transform(data, blocks)
-            data = data[64 * blocks:]
+        if len(data) - pos >= 64:
+            blocks = (len(data) - pos) // 64
+            self.Transform(data, blocks, pos)
+            pos += 64 * blocks
             self.bytes_count += 64 * blocks
 
-        if len(data) > 0:
-            assert len(data) < 64
+        if len(data) > pos:
+            assert len(data) - pos < 64
             # Fill the buffer with what remains.
-            self.buf = self.buf + data
-            self.bytes_count += len(data)
+            self.buf = self.buf + data[pos:]
+            self.bytes_count += len(data) - pos
 
         return self
 
@@ -10640,46 +10634,165 @@ class CSHA256():
         return self.Midstate()
 
     def Midstate(self) -> bytes:
-        s = self.s
-
-        def ToBE32(x: int) -> bytes:
-            return struct.pack(b">I", x)
-
-        hash_chunks = []
-        hash_chunks.append(ToBE32(s[0]))
-        hash_chunks.append(ToBE32(s[1]))
-        hash_chunks.append(ToBE32(s[2]))
-        hash_chunks.append(ToBE32(s[3]))
-        hash_chunks.append(ToBE32(s[4]))
-        hash_chunks.append(ToBE32(s[5]))
-        hash_chunks.append(ToBE32(s[6]))
-        hash_chunks.append(ToBE32(s[7]))
-
-        return b''.join(hash_chunks)
+        return struct.pack('>8I', *self.s)
 
     def Reset(self) -> 'CSHA256':
         self.buf = b''  # type: bytes
         self.bytes_count = 0  # type: int
-        self.s = [0x6a09e667,
-                  0xbb67ae85,
-                  0x3c6ef372,
-                  0xa54ff53a,
-                  0x510e527f,
-                  0x9b05688c,
-                  0x1f83d9ab,
-                  0x5be0cd19]
+        self.s = list(SHA256_INITIAL_STATE)
         return self
 
 
+def get_compiled_ripemd160_function() -> Optional[Callable[[bytes], bytes]]:
+    """Return the function that computes RIPEMD160 with compiled code,
+    or None if neither hashlib nor pycryptodome can provide it"""
+
+    # Newer OpenSSL versions may have RIPEMD160 only in the 'legacy'
+    # provider, in which case hashlib will raise ValueError for it
+    try:
+        hashlib.new('ripemd160', b'')
+    except ValueError:
+        pass
+    else:
+        return lambda data: hashlib.new('ripemd160', data).digest()
+
+    try:
+        from Crypto.Hash import RIPEMD160
+    except ImportError:
+        return None
+
+    return lambda data: RIPEMD160.new(data).digest()
+
+
+COMPILED_RIPEMD160 = get_compiled_ripemd160_function()
+
+
+# Message schedule indexes for the left path of RIPEMD160.
+RIPEMD160_ML = bytes((
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+    3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
+    1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+    4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13
+))
+
+# Message schedule indexes for the right path of RIPEMD160.
+RIPEMD160_MR = bytes((
+    5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
+    6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+    15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
+    8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+    12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11
+))
+
+# Rotation counts for the left path of RIPEMD160.
+RIPEMD160_RL = bytes((
+    11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
+    7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+    11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
+    11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+    9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6
+))
+
+# Rotation counts for the right path of RIPEMD160.
+RIPEMD160_RR = bytes((
+    8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
+    9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+    9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
+    15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+    8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11
+))
+
+# K constants for the left path of RIPEMD160.
+RIPEMD160_KL = (0, 0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xa953fd4e)
+
+# K constants for the right path of RIPEMD160.
+RIPEMD160_KR = (0x50a28be6, 0x5c4dd124, 0x6d703ef3, 0x7a6d76e9, 0)
+
+
+# The f1, f2, f3, f4, and f5 functions from the RIPEMD160 specification.
+# These are separate functions rather than one function with
+# the selector argument, so that the choice is made once per
+# 16 rounds rather than on each call
+
+def ripemd160_f1(x: int, y: int, z: int) -> int:
+    return x ^ y ^ z
+
+
+def ripemd160_f2(x: int, y: int, z: int) -> int:
+    return (x & y) | (~x & z)
+
+
+def ripemd160_f3(x: int, y: int, z: int) -> int:
+    return (x | ~y) ^ z
+
+
+def ripemd160_f4(x: int, y: int, z: int) -> int:
+    return (x & z) | (y & ~z)
+
+
+def ripemd160_f5(x: int, y: int, z: int) -> int:
+    return x ^ (y | ~z)
+
+
+RIPEMD160_FI = (ripemd160_f1, ripemd160_f2, ripemd160_f3,
+                ripemd160_f4, ripemd160_f5)
+
+
+def ripemd160_rol(x: int, i: int) -> int:
+    """Rotate the bottom 32 bits of x left by i bits."""
+    return ((x << i) | ((x & 0xffffffff) >> (32 - i))) & 0xffffffff
+
+
+def ripemd160_compress(state: list[int], block: Union[bytes, memoryview]
+                       ) -> None:
+    """Compress RIPEMD160 state [h0, h1, h2, h3, h4] with block,
+    updating the state in place."""
+    h0, h1, h2, h3, h4 = state
+    ML, MR, RL, RR = RIPEMD160_ML, RIPEMD160_MR, RIPEMD160_RL, RIPEMD160_RR
+    rol = ripemd160_rol
+    # Left path variables.
+    al, bl, cl, dl, el = h0, h1, h2, h3, h4
+    # Right path variables.
+    ar, br, cr, dr, er = h0, h1, h2, h3, h4
+    # Message variables.
+    x = struct.unpack('<16I', block)
+
+    # Iterate over the 80 rounds of the compression, in 5 groups
+    # of 16 rounds that share the same f functions and K constants.
+    for rnd in range(5):
+        fl = RIPEMD160_FI[rnd]
+        fr = RIPEMD160_FI[4 - rnd]
+        kl = RIPEMD160_KL[rnd]
+        kr = RIPEMD160_KR[rnd]
+        for j in range(rnd * 16, rnd * 16 + 16):
+            # Perform left side of the transformation.
+            al = rol(al + fl(bl, cl, dl) + x[ML[j]] + kl, RL[j]) + el
+            al, bl, cl, dl, el = el, al, bl, rol(cl, 10), dl
+            # Perform right side of the transformation.
+            ar = rol(ar + fr(br, cr, dr) + x[MR[j]] + kr, RR[j]) + er
+            ar, br, cr, dr, er = er, ar, br, rol(cr, 10), dr
+
+    # Compose old state, left transform, and right transform into new state.
+    state[0] = (h1 + cl + dr) & 0xffffffff
+    state[1] = (h2 + dl + er) & 0xffffffff
+    state[2] = (h3 + el + ar) & 0xffffffff
+    state[3] = (h4 + al + br) & 0xffffffff
+    state[4] = (h0 + bl + cr) & 0xffffffff
+
+
 def ripemd160(data: bytes) -> bytes:
     """
-    Pure Python RIPEMD160 implementation.
+    Pure Python RIPEMD160 implementation, used only when RIPEMD160 is
+    not available via hashlib or pycryptodome.
 
     The code is not constant-time! This should NOT be used for working with
     secret data, such as, for example  building a MAC (message authentication
     code), etc.
 
-    The code in this function is Copyright (c) 2021 Pieter Wuille.
+    The code in this function, as well as the code of ripemd160_*
+    functions and RIPEMD160_* constants that precede it, is
+    Copyright (c) 2021 Pieter Wuille.
 
     It was distributed under MIT software license along with Bitcoin Core
     test framework.
@@ -10687,7 +10800,7 @@ def ripemd160(data: bytes) -> bytes:
     Type annotations was added by Dmitry petukhov, as well as some
     code rearrangement.
 
-    As MIT license allows sublicensing, the code in this function is
+    As MIT license allows sublicensing, the code mentioned above is
     re-licensed under the the same license as the whole file it is contained
     within is licensed under (see the header of the file, or accompanying
     LICENSE.md file)
@@ -10720,103 +10833,49 @@ def ripemd160(data: bytes) -> bytes:
 
     """
 
-    # Message schedule indexes for the left path.
-    ML = [
-        0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
-        7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
-        3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
-        1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
-        4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13
-    ]
-
-    # Message schedule indexes for the right path.
-    MR = [
-        5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
-        6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
-        15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
-        8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
-        12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11
-    ]
-
-    # Rotation counts for the left path.
-    RL = [
-        11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
-        7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
-        11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
-        11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
-        9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6
-    ]
-
-    # Rotation counts for the right path.
-    RR = [
-        8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
-        9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
-        9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
-        15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
-        8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11
-    ]
-
-    # K constants for the left path.
-    KL = [0, 0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xa953fd4e]
-
-    # K constants for the right path.
-    KR = [0x50a28be6, 0x5c4dd124, 0x6d703ef3, 0x7a6d76e9, 0]
-
-    def fi(x: int, y: int, z: int, i: int) -> int:
-        """The f1, f2, f3, f4, and f5 functions from the specification."""
-        if i == 0:
-            return x ^ y ^ z
-        elif i == 1:
-            return (x & y) | (~x & z)
-        elif i == 2:
-            return (x | ~y) ^ z
-        elif i == 3:
-            return (x & z) | (y & ~z)
-        elif i == 4:
-            return x ^ (y | ~z)
-        else:
-            assert False
-
-    def rol(x: int, i: int) -> int:
-        """Rotate the bottom 32 bits of x left by i bits."""
-        return ((x << i) | ((x & 0xffffffff) >> (32 - i))) & 0xffffffff
-
-    def compress(h0: int, h1: int, h2: int, h3: int, h4: int, block: bytes
-                 ) -> tuple[int, int, int, int, int]:
-        """Compress state (h0, h1, h2, h3, h4) with block."""
-        # Left path variables.
-        al, bl, cl, dl, el = h0, h1, h2, h3, h4
-        # Right path variables.
-        ar, br, cr, dr, er = h0, h1, h2, h3, h4
-        # Message variables.
-        x = [int.from_bytes(block[4*i:4*(i+1)], 'little') for i in range(16)]
-
-        # Iterate over the 80 rounds of the compression.
-        for j in range(80):
-            rnd = j >> 4
-            # Perform left side of the transformation.
-            al = rol(al + fi(bl, cl, dl, rnd) + x[ML[j]] + KL[rnd], RL[j]) + el
-            al, bl, cl, dl, el = el, al, bl, rol(cl, 10), dl
-            # Perform right side of the transformation.
-            ar = rol(ar + fi(br, cr, dr, 4 - rnd) + x[MR[j]] + KR[rnd], RR[j]) + er
-            ar, br, cr, dr, er = er, ar, br, rol(cr, 10), dr
-
-        # Compose old state, left transform, and right transform into new state.
-        return h1 + cl + dr, h2 + dl + er, h3 + el + ar, h4 + al + br, h0 + bl + cr
+    if COMPILED_RIPEMD160:
+        return COMPILED_RIPEMD160(data)
 
     # Initialize state.
-    state = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0)
-    # Process full 64-byte blocks in the input.
+    state = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0]
+    # Process full 64-byte blocks in the input, without copying them.
+    mv = memoryview(data)
     for b in range(len(data) >> 6):
-        state = compress(*state, data[64*b:64*(b+1)])
+        ripemd160_compress(state, mv[64*b:64*(b+1)])
     # Construct final blocks (with padding and size).
     pad = b"\x80" + b"\x00" * ((119 - len(data)) & 63)
     fin = data[len(data) & ~63:] + pad + (8 * len(data)).to_bytes(8, 'little')
     # Process final blocks.
     for b in range(len(fin) >> 6):
-        state = compress(*state, fin[64*b:64*(b+1)])
+        ripemd160_compress(state, fin[64*b:64*(b+1)])
     # Produce output.
-    return b"".join((h & 0xffffffff).to_bytes(4, 'little') for h in state)
+    return struct.pack('<5I', *state)
+
+
+def _hash_sha1(data: bytes) -> bytes:
+    return hashlib.sha1(data).digest()
+
+
+def _hash_sha256(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def _hash_hash160(data: bytes) -> bytes:
+    return ripemd160(hashlib.sha256(data).digest())
+
+
+def _hash_hash256(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+# Hash functions for the hashing opcodes, along with their digest sizes
+HASH_OPCODE_FUNCTIONS: dict[str, tuple[Callable[[bytes], bytes], int]] = {
+    'RIPEMD160': (ripemd160, 20),
+    'SHA1': (_hash_sha1, 20),
+    'SHA256': (_hash_sha256, 32),
+    'HASH160': (_hash_hash160, 20),
+    'HASH256': (_hash_hash256, 32),
+}
 
 
 def parse_input_file(env: SymEnvironment) -> ScriptInfo:
@@ -10824,10 +10883,15 @@ def parse_input_file(env: SymEnvironment) -> ScriptInfo:
         return si
 
     if env.input_file == '-':
-        lines = sys.stdin.readlines()
+        text = sys.stdin.read()
     else:
         with open(env.input_file) as f:
-            lines = f.readlines()
+            text = f.read()
+
+    # Same lines as readlines() would give, only without the newlines
+    lines = text.split('\n')
+    if not lines[-1]:
+        lines.pop()
 
     return parse_script_lines(lines)
 
@@ -10864,38 +10928,56 @@ def sigchld_handler(_signum: int, _frame: Any) -> None:
         pass
 
 
-def try_import_secp256k1(env: SymEnvironment) -> None:
-
-    if env.secp256k1_handle is not None:
-        return
+@lru_cache(maxsize=None)
+def load_secp256k1() -> Optional[tuple[ctypes.CDLL, Any, bool]]:
+    """Load secp256k1 library and set up the functions we use from it.
+    Returns the library handle, the context, and the flag that tells if
+    x-only pubkeys are supported by the library, or None if the library
+    is not available. Done only once, because finding the library
+    might be costly"""
 
     path = ctypes.util.find_library('secp256k1')
-    if path is not None:
-        try:
-            env.secp256k1_handle = ctypes.cdll.LoadLibrary(path)
-        except Exception as e:
-            sys.stderr.write(
-                f'ERROR:, secp256k1 library was found at {path}: but loading '
-                f'it retured error {e}')
-            sys.stderr.flush()
-            return
+    if path is None:
+        return None
 
-        env.secp256k1_context = env.secp256k1_handle.secp256k1_context_create(
-            0x101)  # 0x101 means 'verify' context type
+    try:
+        handle = ctypes.cdll.LoadLibrary(path)
+    except Exception as e:
+        sys.stderr.write(
+            f'ERROR:, secp256k1 library was found at {path}: but loading '
+            f'it retured error {e}')
+        sys.stderr.flush()
+        return None
 
-        if env.secp256k1_context is None:
-            env.secp256k1_handle = None
-            sys.stderr.write(
-                f'ERROR:, secp256k1 library was found at {path}: and '
-                f'loaded, but secp256k1_context_create() failed')
-            return
+    context = handle.secp256k1_context_create(
+        0x101)  # 0x101 means 'verify' context type
+
+    if context is None:
+        sys.stderr.write(
+            f'ERROR:, secp256k1 library was found at {path}: and '
+            f'loaded, but secp256k1_context_create() failed')
+        return None
+
+    has_xonly_pubkeys = False
+
+    handle.secp256k1_ec_pubkey_parse.restype = ctypes.c_int
+    handle.secp256k1_ec_pubkey_parse.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t]
+    if getattr(handle, 'secp256k1_xonly_pubkey_parse', None):
+        handle.secp256k1_xonly_pubkey_parse.restype = ctypes.c_int
+        handle.secp256k1_xonly_pubkey_parse.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+        has_xonly_pubkeys = True
+
+    return handle, context, has_xonly_pubkeys
+
+
+def try_import_secp256k1(env: SymEnvironment) -> None:
+
+    if env.secp256k1_handle is not None:
+        return
 
-        env.secp256k1_handle.secp256k1_ec_pubkey_parse.restype = ctypes.c_int
-        env.secp256k1_handle.secp256k1_ec_pubkey_parse.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t]
-        if getattr(env.secp256k1_handle, 'secp256k1_xonly_pubkey_parse', None):
-            env.secp256k1_handle.secp256k1_xonly_pubkey_parse.restype = ctypes.c_int
-            env.secp256k1_handle.secp256k1_xonly_pubkey_parse.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
-            env.secp256k1_has_xonly_pubkeys = True
+    if secp256k1_info := load_secp256k1():
+        (env.secp256k1_handle, env.secp256k1_context,
+         env.secp256k1_has_xonly_pubkeys) = secp256k1_info
 
 
 def usage() -> None:
@@ -1,11 +1,26 @@
 from types import ModuleType
-from typing import Any
+from typing import Any, Iterable
 
 if not Any:
     # mock-import bsst - for mypy. we will set bsst global inside init()
     import bsst
 
 
+def collect_dependencies(sd: 'bsst.SymData') -> set['bsst.SymData']:
+    """Return the set of SymData instances that sd depends on,
+    including sd itself. sd.depends_on(x) is the same as x in this set"""
+
+    result: set['bsst.SymData'] = set()
+    to_visit = [sd]
+    while to_visit:
+        cur_sd = to_visit.pop()
+        if cur_sd not in result:
+            result.add(cur_sd)
+            to_visit.extend(cur_sd.args)
+
+    return result
+
+
 def post_finalize(env: 'bsst.SymEnvironment', ctx: 'bsst.ExecContext',  # noqa
                   state: dict[str, Any]) -> None:
     if not env.produce_model_values:
@@ -14,6 +29,59 @@ def post_finalize(env: 'bsst.SymEnvironment', ctx: 'bsst.ExecContext',  # noqa
                         'generated')
         return
 
+    if not ctx.model_value_name_dict:
+        return
+
+    # Everything that is computed before the loop over model values does
+    # not depend on the model value, no need to compute it for each value.
+    # Dependencies are collected into sets once, so that the checks
+    # for each value do not need to walk the dependency graph again
+    enf_deps = [(enf, collect_dependencies(enf.cond))
+                for enf in ctx.enforcements]
+
+    seen_enforcement_pcs: set[int] = set()
+
+    def maybe_enf_dep(sd: 'bsst.SymData') -> str:
+        enf_strings: list[str] = []
+        for enf, deps in enf_deps:
+            if sd in deps:
+                seen_enforcement_pcs.add(enf.pc)
+                enf_strings.append(bsst.op_pos_info(enf.pc))
+
+        if not enf_strings:
+            return ''
+
+        if len(enf_strings) == 1:
+            return f' (in enforcement @ {enf_strings[0]})'
+
+        return f' (in enforcements @ {", ".join(enf_strings)})'
+
+    def collect_strict_dependencies(sdlist: Iterable['bsst.SymData']
+                                    ) -> set['bsst.SymData']:
+        # SymData instances that any of sdlist depends on, not counting
+        # the dependency of each SymData on itself
+        result: set['bsst.SymData'] = set()
+        for sd in sdlist:
+            result.update(dep for dep in collect_dependencies(sd)
+                          if dep is not sd)
+
+        return result
+
+    cso_info = [
+        (cso, f'{cso.op} @ {bsst.op_pos_info(cso.pc)}',
+         maybe_enf_dep(cso.result),
+         set(cso.signatures), collect_strict_dependencies(cso.signatures),
+         set(cso.pubkeys), collect_strict_dependencies(cso.pubkeys),
+         collect_dependencies(cso.data) if cso.data else set())
+        for cso in ctx.sig_check_operations
+    ]
+
+    ho_info = [
+        (ho, f'{ho.op} @ {bsst.op_pos_info(ho.pc)}', maybe_enf_dep(ho.result),
+         collect_dependencies(ho.data))
+        for ho in ctx.hash_operations
+    ]
+
     for name, val in ctx.model_value_name_dict.items():
         mvrdict = ctx.model_value_repr_dict.get(name, {})
         results = {
@@ -21,41 +89,21 @@ def post_finalize(env: 'bsst.SymEnvironment', ctx: 'bsst.ExecContext',  # noqa
             for key in state.keys()
         }
 
-        seen_enforcement_pcs: set[int] = set()
-
-        def maybe_enf_dep(sd: 'bsst.SymData') -> str:
-            enf_strings: list[str] = []
-            for enf in ctx.enforcements:
-                if enf.cond.depends_on(sd):
-                    seen_enforcement_pcs.add(enf.pc)
-                    enf_strings.append(f'{bsst.op_pos_info(enf.pc)}')
-
-            if not enf_strings:
-                return ''
-
-            if len(enf_strings) == 1:
-                return f' (in enforcement @ {enf_strings[0]})'
-
-            return f' (in enforcements @ {", ".join(enf_strings)})'
-
-        for cso in ctx.sig_check_operations:
-            op_txt = f'{cso.op} @ {bsst.op_pos_info(cso.pc)}'
-            enfdep = maybe_enf_dep(cso.result)
-
-            if val in cso.signatures:
+        for (cso, op_txt, enfdep, sigs, sig_deps, pubs, pub_deps,
+             data_deps) in cso_info:
+            if val in sigs:
                 results['sig'].value_lines.append(
                     f'Used as signature in {op_txt}{enfdep}')
 
-            if any(val != sig and sig.depends_on(val)
-                   for sig in cso.signatures):
+            if val in sig_deps:
                 results['sig_dep'].value_lines.append(
                     f'Used as dependency of signature in {op_txt}{enfdep}')
 
-            if val in cso.pubkeys:
+            if val in pubs:
                 results['pub'].value_lines.append(
                     f'Used as pubkey in {op_txt}{enfdep}')
 
-            if any(val != pub and pub.depends_on(val) for pub in cso.pubkeys):
+            if val in pub_deps:
                 results['pub_dep'].value_lines.append(
                     f'Used as dependency of pubkey in {op_txt}{enfdep}')
 
@@ -63,22 +111,20 @@ def post_finalize(env: 'bsst.SymEnvironment', ctx: 'bsst.ExecContext',  # noqa
                 if val == cso.data:
                     results['sigdata'].value_lines.append(
                         f'Used as data in {op_txt}{enfdep}')
-                elif cso.data.depends_on(val):
+                elif val in data_deps:
                     results['sigdata_dep'].value_lines.append(
                         f'Used as dependency of data in {op_txt}{enfdep}')
 
-        for ho in ctx.hash_operations:
-            op_txt = f'{ho.op} @ {bsst.op_pos_info(ho.pc)}'
-            enfdep = maybe_enf_dep(ho.result)
+        for ho, op_txt, enfdep, data_deps in ho_info:
             if val == ho.data:
                 results['preimage'].value_lines.append(
                     f'Used as preimage in {op_txt}{enfdep}')
-            elif ho.data.depends_on(val):
+            elif val in data_deps:
                 results['preimage_dep'].value_lines.append(
                     f'Used as dependency of preimage in {op_txt}{enfdep}')
 
-        for enf in ctx.enforcements:
-            if enf.pc not in seen_enforcement_pcs and enf.cond.depends_on(val):
+        for enf, deps in enf_deps:
+            if enf.pc not in seen_enforcement_pcs and val in deps:
                 results['enf_dep'].value_lines.append(
                     f'Used in enforcement @ {bsst.op_pos_info(enf.pc)}')
 
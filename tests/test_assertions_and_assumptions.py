@@ -6,6 +6,9 @@ from typing import Generator, Sequence, Any
 
 import bsst
 
+FAILCODE_RE = re.compile('check_(assumption|assertion)_at_line_(\\d+)')
+ASSERTION_FAILURE_RE = re.compile('assertion failed at line (\\d+)')
+
 
 @contextmanager
 def FreshEnv(*, z3_enabled: bool
@@ -475,14 +478,13 @@ def test_assn_failing(
             pc, errstr = ctx.failure
             if errstr.startswith(bsst.SCRIPT_FAILURE_PREFIX_SOLVER):
                 for code, pc in bsst.parse_failcodes(errstr):
-                    m = re.match('check_(assumption|assertion)_at_line_(\\d+)',
-                                 code)
+                    m = FAILCODE_RE.match(code)
                     assert m, (f'assertion or assumption failure expected, '
                                f'but got "{code}"')
                     fl = int(m.group(2))
                     flines.add(fl)
             else:
-                m = re.match('assertion failed at line (\\d+)', errstr)
+                m = ASSERTION_FAILURE_RE.match(errstr)
                 assert m, (f'assertion or assumption failure expected, '
                            f'but got "{errstr}"')
                 fl = int(m.group(1))
@@ -5,8 +5,10 @@ import os
 import sys
 import json
 import random
+import multiprocessing
+from functools import lru_cache
 from contextlib import contextmanager
-from typing import Generator, NoReturn
+from typing import Generator, NoReturn, Sequence
 
 import elementstx  # noqa
 from bitcointx import select_chain_params
@@ -14,12 +16,25 @@ from bitcointx.core.script import CScript
 
 import bsst
 
+from test_util import get_num_workers, run_captured, report_maybe_dropped
+
 # pylama:ignore=E501,C901
 
 is_tapscript = False
 
 SKIP_UNTIL_TESTCASE = 0
 
+NOP_OR_RESERVED_RE = re.compile('(NOP|RESERVED)\\d+')
+UNNAMED_CSCRIPTOP_RE = re.compile('CScriptOp\\(0x..\\)')
+MINIMAL_PUSHDATA_COMMENT_RE = re.compile(
+    'PUSHDATA\\d+ of \\d+ bytes minimally represented')
+INVALID_KEYS_COUNT_RE = re.compile('\\binvalid keys count\\b')
+INVALID_SIG_COUNT_RE = re.compile('\\binvalid signature count\\b')
+NON_MINIMAL_DATA_RE = re.compile(
+    '\\bnon-minimal immediate data encountered\\b')
+PUBKEY_SIZE_CONSTRAINT_RE = re.compile(
+    '\\btrying to constrain value\\(s\\) with size\\(s\\) \\(33, 65\\) ')
+
 
 @contextmanager
 def FreshEnv(*, z3_enabled: bool = False
@@ -41,13 +56,17 @@ def FreshEnv(*, z3_enabled: bool = False
             yield env
 
 
-def maybe_subst_with_nop(op_str: str, flags: list[str]) -> str:
+# Only these flags affect the result of maybe_subst_with_nop()
+NOP_SUBST_FLAGS = ('CHECKLOCKTIMEVERIFY', 'CHECKSEQUENCEVERIFY')
+
+
+def maybe_subst_with_nop(op_str: str, flags: Sequence[str]) -> str:
     # We do not support some opcodes, but we still want to run
     # testcases that contain them, so we just substitute with NOP.
     # CLTV and CSV have to be replaced if flags do not enable them,
     # because we don't simulate script flags for them
     if op_str in ('VER', 'RESERVED') or \
-            re.match('(NOP|RESERVED)\\d+', op_str) or \
+            NOP_OR_RESERVED_RE.match(op_str) or \
             (op_str in ('CHECKLOCKTIMEVERIFY', 'CHECKSEQUENCEVERIFY')
              and op_str not in flags):
         return 'NOP'
@@ -55,14 +74,44 @@ def maybe_subst_with_nop(op_str: str, flags: list[str]) -> str:
     return op_str
 
 
+# The opcodes that are enabled depend on sigversion, which is set
+# according to is_tapscript, so is_tapscript is a part of the cache key
+@lru_cache(maxsize=None)
+def parse_opcode(op_str: str, tapscript: bool) -> bsst.OpCode:
+    ops = bsst.parse_script_lines([op_str]).body
+    assert len(ops) == 1
+    assert isinstance(ops[0], bsst.OpCode)
+    return ops[0]
+
+
+@lru_cache(maxsize=None)
+def get_enabled_opcodes_by_code(tapscript: bool) -> dict[int, bsst.OpCode]:
+    opcodes_by_code: dict[int, bsst.OpCode] = {}
+    for op in bsst.cur_env().get_enabled_opcodes():
+        opcodes_by_code.setdefault(op.code, op)
+
+    return opcodes_by_code
+
+
 def convert_script(line: str, flags: list[str],
                    ) -> tuple[bsst.OpCode | bsst.ScriptData, ...] | None:
+    # The same scripts appear in many testcases, with different flags
+    return convert_script_memoized(
+        line, tuple(f for f in NOP_SUBST_FLAGS if f in flags), is_tapscript)
+
+
+# The same ScriptData and OpCode objects are returned to every testcase
+# that uses the same script, so they must be treated as immutable
+@lru_cache(maxsize=4096)
+def convert_script_memoized(
+    line: str, flags: tuple[str, ...], tapscript: bool
+) -> tuple[bsst.OpCode | bsst.ScriptData, ...] | None:
     script_bytes: list[bytes] = []
     for op_str in line.split():
         if not op_str:
             continue
 
-        if is_tapscript and op_str.lower().startswith("le64("):
+        if tapscript and op_str.lower().startswith("le64("):
             assert op_str.endswith(')')
             op_str = op_str[5:-1]
 
@@ -97,10 +146,8 @@ def convert_script(line: str, flags: list[str],
         elif len(op_str) >= 2 and op_str[0] == "'" and op_str[-1] == "'":
             script_bytes.append(CScript([op_str[1:-1].encode('utf-8')]))
         else:
-            ops = bsst.parse_script_lines([maybe_subst_with_nop(op_str, flags)]).body
-            assert len(ops) == 1
-            assert isinstance(ops[0], bsst.OpCode)
-            script_bytes.append(CScript(bytes([ops[0].code])))
+            op = parse_opcode(maybe_subst_with_nop(op_str, flags), tapscript)
+            script_bytes.append(CScript(bytes([op.code])))
 
     if not script_bytes:
         return None
@@ -111,13 +158,13 @@ def convert_script(line: str, flags: list[str],
             script_lines.append(f'x(\'{data.hex()}\')')
         else:
             op_str = repr(sop)
-            if re.match('CScriptOp\\(0x..\\)', op_str):
-                for op in bsst.cur_env().get_enabled_opcodes():
-                    if op.code == int(sop):
-                        op_str = op.name
-                        break
-                else:
+            if UNNAMED_CSCRIPTOP_RE.match(op_str):
+                enabled_op = get_enabled_opcodes_by_code(tapscript).get(
+                    int(sop))
+                if enabled_op is None:
                     return None
+
+                op_str = enabled_op.name
             else:
                 assert op_str.startswith('OP_'), op_str
                 op_str = op_str[3:]
@@ -150,6 +197,23 @@ def common_env_settings(env: bsst.SymEnvironment, flags: list[str]) -> None:
     env.nulldummy_flag = 'NULLDUMMY' in flags
 
 
+# Flags that are not modelled, but are checked by process_testcase()
+# when deciding if the result is as expected
+RESULT_CHECK_FLAGS = ('DERSIG', 'P2SH', 'WITNESS')
+
+
+def env_flags_signature(flags: list[str], flags_were_altered: bool
+                        ) -> tuple[bool, ...]:
+    # Processing of the testcase depends on the supported flags that
+    # affect the environment settings, on the flags that decide if CLTV
+    # and CSV are replaced with NOPs, on the flags checked for the result,
+    # and on whether the flags were altered
+    return (tuple(f in flags for f in sorted(supported_flags))
+            + tuple(f in flags for f in NOP_SUBST_FLAGS)
+            + tuple(f in flags for f in RESULT_CHECK_FLAGS)
+            + (flags_were_altered,))
+
+
 valid_contexts: list[bsst.ExecContext] = []
 invalid_contexts: list[bsst.ExecContext] = []
 failures: list[str] = []
@@ -162,35 +226,38 @@ def clean_contexts() -> None:
 
 
 def process_contexts(env: bsst.SymEnvironment) -> None:
-    def do_processing(bp: 'bsst.Branchpoint', level: int) -> None:
-        if bp.context is not None:
-            if bp.context.failure:
-                invalid_contexts.append(bp.context)
-                err = bp.context.failure[1]
-                if err.startswith(bsst.SCRIPT_FAILURE_PREFIX_SOLVER):
-                    for fc in bsst.parse_failcodes(err):
-                        failures.append(fc[0])
-                else:
-                    failures.append(err)
-            else:
-                valid_contexts.append(bp.context)
-
     clean_contexts()
+
+    solver_prefix = bsst.SCRIPT_FAILURE_PREFIX_SOLVER
     root_bp = env.get_root_branch()
-    root_bp.walk_branches(do_processing)
+    for ctx in root_bp.iter_contexts(include_failed=True):
+        if ctx.failure:
+            invalid_contexts.append(ctx)
+            err = ctx.failure[1]
+            if err.startswith(solver_prefix):
+                failures.extend(fc[0] for fc in bsst.parse_failcodes(err))
+            else:
+                failures.append(err)
+        else:
+            valid_contexts.append(ctx)
 
 
 def set_script_body(script_body: tuple[bsst.OpCode | bsst.ScriptData, ...]
                     ) -> None:
-    line_no_table = []
-    for pc in range(len(script_body)):
-        line_no_table.append(pc)
+    # each opcode is on its own line, plus the line after the end
+    env = bsst.cur_env()
+    env.script_info = bsst.ScriptInfo(
+        body=script_body, line_no_table=range(len(script_body) + 1))
 
-    line_no_table.append(len(script_body))
 
-    env = bsst.cur_env()
-    env.script_info = bsst.ScriptInfo(body=script_body,
-                                      line_no_table=line_no_table)
+def check_p2sh(scriptPubKey: tuple[bsst.OpCode | bsst.ScriptData, ...]
+               ) -> None:
+    assert len(scriptPubKey) == 3
+    assert scriptPubKey[0] == bsst.OP_HASH160
+    assert isinstance(scriptPubKey[1], bsst.ScriptData)
+    assert isinstance(scriptPubKey[1].value, bytes)
+    assert len(scriptPubKey[1].value) == 0x14
+    assert scriptPubKey[2] == bsst.OP_EQUAL
 
 
 def process_testcase_single(
@@ -207,14 +274,6 @@ def process_testcase_single(
     if use_nonstatic_witnesses:
         assert z3_enabled
 
-    def check_p2sh() -> None:
-        assert len(scriptPubKey) == 3
-        assert scriptPubKey[0] == bsst.OP_HASH160
-        assert isinstance(scriptPubKey[1], bsst.ScriptData)
-        assert isinstance(scriptPubKey[1].value, bytes)
-        assert len(scriptPubKey[1].value) == 0x14
-        assert scriptPubKey[2] == bsst.OP_EQUAL
-
     with FreshEnv(z3_enabled=z3_enabled) as env:
         set_script_body(scriptPubKey)
         common_env_settings(env, flags)
@@ -266,8 +325,7 @@ def process_testcase_single(
 
         process_contexts(env)
 
-        bsst.report()
-        sys.stdout.flush()
+        report_maybe_dropped()
 
         for f in failures:
             if (
@@ -297,7 +355,7 @@ def process_testcase_single(
                 return
 
             if comment == 'P2SH with CLEANSTACK':
-                check_p2sh()
+                check_p2sh(scriptPubKey)
                 return
 
             if comment in ('Overly long signature is correctly encoded',
@@ -348,7 +406,7 @@ def process_testcase_single(
             for ctx in valid_contexts:
                 if expected_result in ('EVAL_FALSE', 'EQUALVERIFY') and \
                         comment.startswith('P2SH'):
-                    check_p2sh()
+                    check_p2sh(scriptPubKey)
                 elif expected_result == 'EVAL_FALSE':
                     if ctx.used_witnesses:
                         assert ctx.stack[-1] is ctx.used_witnesses[0]
@@ -430,14 +488,14 @@ def process_testcase_single(
         elif expected_result == 'STACK_SIZE':
             assert any(f.startswith('stack overflow') for f in failures)
         elif expected_result == 'PUBKEY_COUNT':
-            assert any(re.search('\\binvalid keys count\\b', f) for f in failures)
+            assert any(INVALID_KEYS_COUNT_RE.search(f) for f in failures)
         elif expected_result == 'SIG_COUNT':
-            assert any(re.search('\\binvalid signature count\\b', f) for f in failures)
+            assert any(INVALID_SIG_COUNT_RE.search(f) for f in failures)
         elif expected_result == 'MINIMALDATA':
-            assert any(re.search('\\bnon-minimal immediate data encountered\\b', f) for f in failures)
+            assert any(NON_MINIMAL_DATA_RE.search(f) for f in failures)
         elif expected_result == 'PUBKEYTYPE':
             assert any(
-                re.search('\\btrying to constrain value\\(s\\) with size\\(s\\) \\(33, 65\\) ', f)
+                PUBKEY_SIZE_CONSTRAINT_RE.search(f)
                 or
                 f == 'check_invalid_pubkey'
                 for f in failures)
@@ -515,8 +573,7 @@ def process_testcase(
             print("Sym-exec SSig")
 
             bsst.symex_script()
-            bsst.report()
-            sys.stdout.flush()
+            report_maybe_dropped()
 
             process_contexts(env)
 
@@ -589,100 +646,136 @@ def process_testcase(
             flags_were_altered=flags_were_altered)
 
 
-def test() -> None:
-    global is_tapscript
+def run_testcase(tc_no: int, testcase: list[str]) -> None:
+    print("TESTCASE no.", tc_no)
+    if tc_no < SKIP_UNTIL_TESTCASE:
+        return
 
-    if len(sys.argv) < 2:
-        die('must specify path to script_tests.json and chain name\n')
+    if isinstance(testcase[0], list):
+        # skip witness program tests
+        return
 
-    select_chain_params('elements')
+    print("TESTCASE body:", testcase)
 
-    if len(sys.argv) == 3 and sys.argv[2] == 'tapscript':
-        is_tapscript = True
+    flags = testcase[2].split(',')
+    expected_result = testcase[3]
+    if expected_result in ('BAD_OPCODE', 'DISABLED_OPCODE'):
+        return
 
-    with open(sys.argv[1], 'r') as f:
-        tc_no = 0
-        for testcase in json.load(f):
-            if len(testcase) < 2:
-                # a comment, skip it.
-                continue
+    with FreshEnv():
+        scriptSig = convert_script(testcase[0], flags)
+        scriptPubKey = convert_script(testcase[1], flags)
 
-            tc_no += 1
-            print("TESTCASE no.", tc_no)
-            if tc_no < SKIP_UNTIL_TESTCASE:
-                continue
+    if scriptPubKey is None:
+        return
 
-            if isinstance(testcase[0], list):
-                # skip witness program tests
-                continue
+    comment = ''
+    if len(testcase) > 4:
+        comment = testcase[4]
 
-            print("TESTCASE body:", testcase)
+    print("SSig", scriptSig)
+    print("SPK", scriptPubKey)
+    print("FLAGS", flags)
+    print("ERes", expected_result)
+    print()
 
-            flags = testcase[2].split(',')
-            expected_result = testcase[3]
-            if expected_result in ('BAD_OPCODE', 'DISABLED_OPCODE'):
-                continue
+    if expected_result in ('SCRIPT_SIZE', 'SIG_PUSHONLY'):
+        # we do not model these
+        return
 
-            with FreshEnv():
-                scriptSig = convert_script(testcase[0], flags)
-                scriptPubKey = convert_script(testcase[1], flags)
+    if expected_result == 'MINIMALDATA':
+        if MINIMAL_PUSHDATA_COMMENT_RE.match(comment):
+            return
 
-            if scriptPubKey is None:
+    z3_only = False
+    if 'Z3' in flags:
+        z3_only = True
+        flags.remove('Z3')
+
+    process_testcase(
+        scriptSig=scriptSig, scriptPubKey=scriptPubKey,
+        flags=flags, comment=comment, expected_result=expected_result,
+        z3_only=z3_only)
+
+    if os.getenv('BSST_TESTS_NO_FLAGS_SHUFFLE'):
+        return
+
+    if expected_result == 'OK':
+        random.shuffle(flags)
+        seen_env_signatures = {env_flags_signature(flags, False)}
+        # check that removing flags does not change the result
+        while(flags):
+            flags.pop()
+            env_signature = env_flags_signature(flags, True)
+            if env_signature in seen_env_signatures:
+                # removed flag is not one that affects processing, the result
+                # would be the same as for already processed flag set
                 continue
 
-            comment = ''
-            if len(testcase) > 4:
-                comment = testcase[4]
+            seen_env_signatures.add(env_signature)
+            process_testcase(
+                scriptSig=scriptSig, scriptPubKey=scriptPubKey,
+                flags=flags, comment=comment,
+                expected_result=expected_result,
+                flags_were_altered=True, z3_only=z3_only)
+    else:
+        # check that adding flags does not change the result
+        flags_to_add = list(supported_flags - set(flags))
+        random.shuffle(flags_to_add)
+        while(flags_to_add):
+            process_testcase(
+                scriptSig=scriptSig, scriptPubKey=scriptPubKey,
+                flags=flags+list(flags_to_add), comment=comment,
+                expected_result=expected_result,
+                flags_were_altered=True, z3_only=z3_only)
+            flags_to_add.pop()
 
-            print("SSig", scriptSig)
-            print("SPK", scriptPubKey)
-            print("FLAGS", flags)
-            print("ERes", expected_result)
-            print()
 
-            if expected_result in ('SCRIPT_SIZE', 'SIG_PUSHONLY'):
-                # we do not model these
-                continue
+def init_worker(tapscript: bool) -> None:
+    global is_tapscript
 
-            if expected_result == 'MINIMALDATA':
-                if re.match('PUSHDATA\\d+ of \\d+ bytes minimally represented',
-                            comment):
-                    continue
+    select_chain_params('elements')
+    is_tapscript = tapscript
 
-            z3_only = False
-            if 'Z3' in flags:
-                z3_only = True
-                flags.remove('Z3')
 
-            process_testcase(
-                scriptSig=scriptSig, scriptPubKey=scriptPubKey,
-                flags=flags, comment=comment, expected_result=expected_result,
-                z3_only=z3_only)
+def run_testcase_in_worker(tc_no_and_testcase: tuple[int, list[str]]
+                           ) -> tuple[str, str]:
+    return run_captured(run_testcase, *tc_no_and_testcase)
 
-            if os.getenv('BSST_TESTS_NO_FLAGS_SHUFFLE'):
-                continue
 
-            if expected_result == 'OK':
-                random.shuffle(flags)
-                # check that removing flags does not change the result
-                while(flags):
-                    flags.pop()
-                    process_testcase(
-                        scriptSig=scriptSig, scriptPubKey=scriptPubKey,
-                        flags=flags, comment=comment,
-                        expected_result=expected_result,
-                        flags_were_altered=True, z3_only=z3_only)
-            else:
-                # check that adding flags does not change the result
-                flags_to_add = list(supported_flags - set(flags))
-                random.shuffle(flags_to_add)
-                while(flags_to_add):
-                    process_testcase(
-                        scriptSig=scriptSig, scriptPubKey=scriptPubKey,
-                        flags=flags+list(flags_to_add), comment=comment,
-                        expected_result=expected_result,
-                        flags_were_altered=True, z3_only=z3_only)
-                    flags_to_add.pop()
+def test() -> None:
+    global is_tapscript
+
+    if len(sys.argv) < 2:
+        die('must specify path to script_tests.json and chain name\n')
+
+    select_chain_params('elements')
+
+    if len(sys.argv) == 3 and sys.argv[2] == 'tapscript':
+        is_tapscript = True
+
+    with open(sys.argv[1], 'r') as f:
+        # entries with less than 2 elements are comments
+        testcases = list(enumerate(
+            (testcase for testcase in json.load(f) if len(testcase) >= 2),
+            start=1))
+
+    num_workers = get_num_workers()
+
+    if num_workers <= 1:
+        for tc_no, testcase in testcases:
+            run_testcase(tc_no, testcase)
+
+        return
+
+    with multiprocessing.Pool(num_workers, initializer=init_worker,
+                              initargs=(is_tapscript,)) as pool:
+        for output, error in pool.imap(run_testcase_in_worker, testcases,
+                                       chunksize=8):
+            sys.stdout.write(output)
+            if error:
+                sys.stdout.flush()
+                die(f'testcase failed:\n{error}')
 
 
 if __name__ == '__main__':
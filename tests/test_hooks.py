@@ -42,7 +42,6 @@ g_state_copy: dict[str, Any] = {}
 def plugin_settings(env: bsst.SymEnvironment, value_str: str,
                     state: dict[str, Any]) -> None:
     state['setting'] = int(value_str)
-    g_state_copy.update(state.copy())
 
 
 def plugin_comment(env: bsst.SymEnvironment, comment_text: str,
@@ -64,8 +63,6 @@ def plugin_comment(env: bsst.SymEnvironment, comment_text: str,
     else:
         assert 0, "unexpected comment"
 
-    g_state_copy.update(state.copy())
-
 
 def pushdata(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
              sd: bsst.ScriptData, phf: bsst.PluginStackHelperFunctions,
@@ -80,8 +77,6 @@ def pushdata(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
         phf.push(bsst.SymData(static_value=99))
         state['pushdata_done'] = True
 
-    g_state_copy.update(state.copy())
-
 
 def pre_opcode(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
                op: bsst.OpCode, phf: bsst.PluginStackHelperFunctions,
@@ -93,8 +88,6 @@ def pre_opcode(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
         phf.push(bsst.SymData(static_value=555))
         state['pre_opcode_done'] = True
 
-    g_state_copy.update(state.copy())
-
     return False
 
 
@@ -109,8 +102,6 @@ def post_opcode(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
         phf.push(bsst.SymData(name='TEST', args=(v,)))
         state['post_opcode_done'] = True
 
-    g_state_copy.update(state.copy())
-
 
 def pre_finalize(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
                  state: dict[str, Any]) -> None:
@@ -118,16 +109,12 @@ def pre_finalize(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
     assert not ctx.is_finalized
     state['pre_finalize_done'] = True
 
-    g_state_copy.update(state.copy())
-
 
 def post_finalize(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
                   state: dict[str, Any]) -> None:
     assert ctx.is_finalized
     state['post_finalize_done'] = True
 
-    g_state_copy.update(state.copy())
-
 
 def script_failure(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
                    state: dict[str, Any]) -> None:
@@ -136,7 +123,6 @@ def script_failure(env: bsst.SymEnvironment, ctx: bsst.ExecContext,
     pc, err = ctx.failure
     assert pc == state['fail_at']
     state['failure_detected'] = True
-    g_state_copy.update(state.copy())
 
 
 def report_start(env: bsst.SymEnvironment, state: dict[str, Any]) -> None:
@@ -145,6 +131,8 @@ def report_start(env: bsst.SymEnvironment, state: dict[str, Any]) -> None:
 
 def report_end(env: bsst.SymEnvironment, state: dict[str, Any]) -> None:
     env.write_line('TEST_HOOKS_REPORT_END')
+    # The report is the last thing done, so the state is complete by now
+    g_state_copy.update(state)
 
 
 def parse_input_file(env: bsst.SymEnvironment, state: dict[str, Any]
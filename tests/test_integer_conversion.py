@@ -2,13 +2,16 @@
 
 import struct
 import random
+import multiprocessing
 from contextlib import contextmanager
-from typing import Generator, Callable
+from typing import Generator, Callable, NamedTuple
 
 import z3
 
 import bsst
 
+from test_util import get_num_workers, run_captured
+
 
 @contextmanager
 def FreshEnv() -> Generator[None, None, None]:
@@ -23,38 +26,80 @@ def FreshEnv() -> Generator[None, None, None]:
             yield
 
 
-def test() -> None:
+class Sweep(NamedTuple):
+    seq2num: Callable[['z3.SeqSortRef', 'z3.ArithRef'], None]
+    int2bytes: Callable[[int], bytes]
+    min_v: int
+    max_v: int
+    max_bytes: int
+
+
+# Sweeps with shorter encodings are faster to solve, and come first,
+# so that failures in them are seen sooner
+SWEEPS: dict[str, Sweep] = {
+    'le32 signed': Sweep(
+        seq2num=lambda seq, x: bsst.le32_signed_to_integer(seq, x),
+        int2bytes=struct.Struct('<i').pack,
+        min_v=-(2**31), max_v=2**31-1, max_bytes=4),
+    'le32 unsigned': Sweep(
+        seq2num=lambda seq, x: bsst.le32_unsigned_to_integer(seq, x),
+        int2bytes=struct.Struct('<I').pack,
+        min_v=0, max_v=2**32-1, max_bytes=4),
+    'scriptnum': Sweep(
+        seq2num=lambda seq, x: bsst.scriptnum_to_sym_integer(seq, x,
+                                                             max_size=5),
+        int2bytes=lambda x: bsst.integer_to_scriptnum(x),
+        min_v=-0x7FFFFFFFFF, max_v=0x7FFFFFFFFF, max_bytes=5),
+    'le64 signed': Sweep(
+        seq2num=lambda seq, x: bsst.le64_signed_to_integer(seq, x),
+        int2bytes=struct.Struct('<q').pack,
+        min_v=-(2**63), max_v=2**63-1, max_bytes=8),
+    'le64 unsigned': Sweep(
+        seq2num=lambda seq, x: bsst.le64_unsigned_to_integer(seq, x),
+        int2bytes=struct.Struct('<Q').pack,
+        min_v=0, max_v=2**64-1, max_bytes=8),
+}
+
+
+def run_sweep(sweep_name: str) -> None:
+    # The sweep is referred to by name, so that it can be sent
+    # to a worker process, as z3 expressions and lambdas can not be pickled
+    sweep = SWEEPS[sweep_name]
+    seq2num = sweep.seq2num
+    int2bytes = sweep.int2bytes
+
     with FreshEnv():
         seq1 = bsst.FreshConst(bsst.IntSeqSortRef(), 'seq')
         seq2 = bsst.FreshConst(bsst.IntSeqSortRef(), 'seq')
         y = bsst.FreshInt('y')
         x = bsst.FreshInt('x')
 
-    def test_common(*,
-                    seq2num: Callable[['z3.SeqSortRef', 'z3.ArithRef'], None],
-                    int2bytes: Callable[[int], bytes],
-                    min_v: int, max_v: int, max_bytes: int) -> None:
+    with FreshEnv():
+        seq2num(seq1, x)
+        seq2num(seq1, y)
+        bsst.Check(x == y)
+        bsst.z3check(force_check=True)
 
-        with FreshEnv():
-            seq2num(seq1, x)
-            seq2num(seq1, y)
-            bsst.Check(x == y)
+    with FreshEnv():
+        seq2num(seq1, x)
+        seq2num(seq2, y)
+        bsst.Check(seq1 != seq2)
+        bsst.Check(x == y)
+        try:
             bsst.z3check(force_check=True)
+        except bsst.ScriptFailure as sf:
+            assert str(sf).startswith(bsst.SCRIPT_FAILURE_PREFIX_SOLVER)
 
-        with FreshEnv():
-            seq2num(seq1, x)
-            seq2num(seq2, y)
-            bsst.Check(seq1 != seq2)
-            bsst.Check(x == y)
-            try:
-                bsst.z3check(force_check=True)
-            except bsst.ScriptFailure as sf:
-                assert str(sf).startswith(bsst.SCRIPT_FAILURE_PREFIX_SOLVER)
+    with FreshEnv():
+        # The constraints of conversion are the same for all iterations,
+        # so they are added once, and the per-iteration constraints
+        # are added in isolated solver context that is discarded after
+        seq2num(seq1, x)
 
         for _ in range(100):
-            with FreshEnv():
-                numbytes = random.randint(1, max_bytes)
-                testval = random.randint(min_v, max_v)
+            with bsst.IsolatedSolverContext():
+                numbytes = random.randint(1, sweep.max_bytes)
+                testval = random.randint(sweep.min_v, sweep.max_v)
                 if testval < 0:
                     testval = -(abs(testval) % (1 << (8*numbytes)))
                 else:
@@ -63,13 +108,12 @@ def test() -> None:
                 testseq = int2bytes(testval)
 
                 bsst.Check(y == testval)
-                seq2num(seq1, x)
                 bsst.Check(seq1 == bsst.IntSeqVal(testseq))
 
                 model = bsst.z3check(
                     force_check=True,
-                    model_values_to_retrieve={'x': (x.decl().name(),
-                                                    bsst.SymDataRType.INT)})
+                    model_values_to_retrieve={
+                        'x': (x.decl().name(), bsst.SymDataRType.INT)})
 
                 assert model
                 assert model['x'].single_value == testval
@@ -81,36 +125,33 @@ def test() -> None:
                     assert str(sf).startswith(
                         bsst.SCRIPT_FAILURE_PREFIX_SOLVER)
 
-    print("testing scriptnum")
-    test_common(
-        seq2num=lambda seq, x: bsst.scriptnum_to_sym_integer(seq, x,
-                                                             max_size=5),
-        int2bytes=lambda x: bsst.integer_to_scriptnum(x),
-        min_v=-0x7FFFFFFFFF, max_v=0x7FFFFFFFFF, max_bytes=5)
 
-    print("testing le32 signed")
-    test_common(
-        seq2num=lambda seq, x: bsst.le32_signed_to_integer(seq, x),
-        int2bytes=lambda x: struct.pack('<i', x),
-        min_v=-(2**31), max_v=2**31-1, max_bytes=4)
-
-    print("testing le32 unsigned")
-    test_common(
-        seq2num=lambda seq, x: bsst.le32_unsigned_to_integer(seq, x),
-        int2bytes=lambda x: struct.pack('<I', x),
-        min_v=0, max_v=2**32-1, max_bytes=4)
+def run_sweep_in_worker(sweep_name: str) -> tuple[str, str]:
+    return run_captured(run_sweep, sweep_name)
 
-    print("testing le64 signed")
-    test_common(
-        seq2num=lambda seq, x: bsst.le64_signed_to_integer(seq, x),
-        int2bytes=lambda x: struct.pack('<q', x),
-        min_v=-(2**63), max_v=2**63-1, max_bytes=8)
 
-    print("testing le64 unsigned")
-    test_common(
-        seq2num=lambda seq, x: bsst.le64_unsigned_to_integer(seq, x),
-        int2bytes=lambda x: struct.pack('<Q', x),
-        min_v=0, max_v=2**64-1, max_bytes=8)
+def test() -> None:
+    num_workers = get_num_workers()
+
+    if num_workers <= 1:
+        for sweep_name in SWEEPS:
+            print(f"testing {sweep_name}")
+            run_sweep(sweep_name)
+
+        return
+
+    errors: list[str] = []
+    with multiprocessing.Pool(min(num_workers, len(SWEEPS))) as pool:
+        for sweep_name, (output, error) in zip(
+                SWEEPS, pool.imap(run_sweep_in_worker, SWEEPS)):
+            print(output, end='')
+            if error:
+                print(f'sweep {sweep_name} failed:\n{error}')
+                errors.append(error)
+            else:
+                print(f"tested {sweep_name}")
+
+    assert not errors, f'{len(errors)} sweep(s) failed'
 
 
 if __name__ == '__main__':
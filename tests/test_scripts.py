@@ -2,17 +2,24 @@
 
 import os
 import struct
+import functools
+import multiprocessing
+import multiprocessing.pool
 from contextlib import contextmanager
-from typing import Generator, Iterable
+from typing import Generator, Iterable, Protocol, Any
 
 from bitcointx.core.key import CKey, XOnlyPubKey
 
 import bsst
 
-from test_util import CaptureStdout
+from test_util import (
+    CaptureStdout, get_num_workers, run_captured, report_maybe_dropped
+)
 
 # pylama:ignore=E501
 
+LOCKTIME_THRESHOLD_HEX = struct.pack('<i', bsst.LOCKTIME_THRESHOLD).hex()
+
 
 @contextmanager
 def FreshEnv(*, z3_enabled: bool = False, is_tapscript: bool = False,
@@ -41,34 +48,27 @@ def FreshEnv(*, z3_enabled: bool = False, is_tapscript: bool = False,
             yield env
 
 
-valid_contexts: list[bsst.ExecContext] = []
-invalid_contexts: list[bsst.ExecContext] = []
-failures: list[str] = []
-
-
-def clean_contexts() -> None:
-    valid_contexts.clear()
-    invalid_contexts.clear()
-    failures.clear()
+def process_contexts(env: bsst.SymEnvironment
+                     ) -> tuple[list[bsst.ExecContext], list[bsst.ExecContext],
+                                list[str]]:
+    valid_contexts: list[bsst.ExecContext] = []
+    invalid_contexts: list[bsst.ExecContext] = []
+    failures: list[str] = []
 
-
-def process_contexts(env: bsst.SymEnvironment) -> None:
-    def do_processing(bp: 'bsst.Branchpoint', level: int) -> None:
-        if bp.context is not None:
-            if bp.context.failure:
-                invalid_contexts.append(bp.context)
-                err = bp.context.failure[1]
-                if err.startswith(bsst.SCRIPT_FAILURE_PREFIX_SOLVER):
-                    for fc in bsst.parse_failcodes(err):
-                        failures.append(fc[0])
-                else:
-                    failures.append(err)
+    solver_prefix = bsst.SCRIPT_FAILURE_PREFIX_SOLVER
+    root_bp = env.get_root_branch()
+    for ctx in root_bp.iter_contexts(include_failed=True):
+        if ctx.failure:
+            invalid_contexts.append(ctx)
+            err = ctx.failure[1]
+            if err.startswith(solver_prefix):
+                failures.extend(fc[0] for fc in bsst.parse_failcodes(err))
             else:
-                valid_contexts.append(bp.context)
+                failures.append(err)
+        else:
+            valid_contexts.append(ctx)
 
-    clean_contexts()
-    root_bp = env.get_root_branch()
-    root_bp.walk_branches(do_processing)
+    return valid_contexts, invalid_contexts, failures
 
 
 def do_test_single(script: str, *,
@@ -93,36 +93,107 @@ def do_test_single(script: str, *,
         env.script_info = bsst.parse_script_lines(script.split('\n'))
 
         bsst.symex_script()
-        bsst.report()
 
-        process_contexts(env)
+        report_maybe_dropped()
+
+        valid_contexts, invalid_contexts, failures = process_contexts(env)
 
         assert len(valid_contexts) == num_successes, len(valid_contexts)
         if not expect_failures:
             assert len(invalid_contexts) == 0
         else:
             assert len(invalid_contexts) > 0
-            assert not (set(failures) - set(expect_failures)), failures
+            expected = frozenset(expect_failures)
+            assert all(f in expected for f in failures), failures
 
         return failures
 
 
+def do_test_variants(*, expect_failures: Iterable[str] = (),
+                     num_successes: int = 1,
+                     is_tapscript: bool = False,
+                     nullfail_flag: bool = False) -> list[dict[str, Any]]:
+    return [dict(z3_enabled=z3_enabled,
+                 is_tapscript=is_tapscript,
+                 expect_failures=tuple(expect_failures),
+                 num_successes=num_successes,
+                 nullfail_flag=nullfail_flag)
+            for z3_enabled in (False, True)]
+
+
 def do_test(script: str, *,
             expect_failures: Iterable[str] = (),
             num_successes: int = 1,
             is_tapscript: bool = False,
             nullfail_flag: bool = False) -> None:
-    do_test_single(script, z3_enabled=False,
-                   is_tapscript=is_tapscript, expect_failures=expect_failures,
-                   num_successes=num_successes,
-                   nullfail_flag=nullfail_flag)
-    do_test_single(script, z3_enabled=True,
-                   is_tapscript=is_tapscript, expect_failures=expect_failures,
-                   num_successes=num_successes,
-                   nullfail_flag=nullfail_flag)
+    for variant_kwargs in do_test_variants(expect_failures=expect_failures,
+                                           num_successes=num_successes,
+                                           is_tapscript=is_tapscript,
+                                           nullfail_flag=nullfail_flag):
+        do_test_single(script, **variant_kwargs)
+
+
+class DoTestFunction(Protocol):
+    def __call__(self, script: str, *,
+                 expect_failures: Iterable[str] = (),
+                 num_successes: int = 1,
+                 is_tapscript: bool = False,
+                 nullfail_flag: bool = False) -> None:
+        ...
 
 
 def test() -> None:
+    num_workers = get_num_workers()
+    if num_workers <= 1:
+        run_tests(do_test)
+        return
+
+    pending_results: list['multiprocessing.pool.AsyncResult[tuple[str, str]]'] = []
+
+    with multiprocessing.Pool(num_workers) as pool:
+
+        # Results of do_test are not used by the caller, so they are only
+        # checked after all tests are submitted, and the tests that follow
+        # can run meanwhile
+        def do_test_in_pool(script: str, *,
+                            expect_failures: Iterable[str] = (),
+                            num_successes: int = 1,
+                            is_tapscript: bool = False,
+                            nullfail_flag: bool = False) -> None:
+            for variant_kwargs in do_test_variants(
+                    expect_failures=expect_failures,
+                    num_successes=num_successes,
+                    is_tapscript=is_tapscript,
+                    nullfail_flag=nullfail_flag):
+                pending_results.append(
+                    pool.apply_async(
+                        run_captured,
+                        (functools.partial(do_test_single, script,
+                                           **variant_kwargs),)))
+
+        errors: list[str] = []
+        try:
+            run_tests(do_test_in_pool)
+        finally:
+            # Worker results are collected and printed even if one of the
+            # tests that run in the main process has failed, so that
+            # failures in workers are not lost
+            for r in pending_results:
+                output, error = r.get()
+                print(output, end='')
+                if error:
+                    print(f'test failed in worker:\n{error}')
+                    errors.append(error)
+
+            pool.close()
+            pool.join()
+
+    assert not errors, f'{len(errors)} test(s) failed in workers'
+
+
+# do_test is passed in by test(), and runs the test either in the main
+# process or in the worker pool
+def run_tests(do_test: DoTestFunction) -> None:
     out: str = ''
 
     k = CKey.from_secret_bytes(os.urandom(32))
@@ -206,10 +277,9 @@ def test() -> None:
                               expect_failures=['check_argument_above_bounds', 'check_equalverify', 'check_final_verify', 'check_negative_argument'])
     assert 'check_argument_above_bounds' in failures
 
-    lktime_threshold_hex = struct.pack('<i', bsst.LOCKTIME_THRESHOLD).hex()
-    do_test_single(f"INSPECTLOCKTIME 0x{lktime_threshold_hex} EQUALVERIFY {bsst.LOCKTIME_THRESHOLD} CHECKLOCKTIMEVERIFY",
+    do_test_single(f"INSPECTLOCKTIME 0x{LOCKTIME_THRESHOLD_HEX} EQUALVERIFY {bsst.LOCKTIME_THRESHOLD} CHECKLOCKTIMEVERIFY",
                    is_tapscript=True, z3_enabled=True, num_successes=1)
-    failures = do_test_single(f"INSPECTLOCKTIME 0x{lktime_threshold_hex} EQUALVERIFY 1 CHECKLOCKTIMEVERIFY",
+    failures = do_test_single(f"INSPECTLOCKTIME 0x{LOCKTIME_THRESHOLD_HEX} EQUALVERIFY 1 CHECKLOCKTIMEVERIFY",
                               is_tapscript=True, z3_enabled=True, num_successes=0,
                               expect_failures=['check_locktime_type_mismatch', 'check_equalverify'])
     assert 'check_locktime_type_mismatch' in failures
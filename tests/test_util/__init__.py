@@ -1,14 +1,74 @@
+import os
 import sys
+import traceback
 
 from io import StringIO
-from typing import Generator
-from contextlib import contextmanager
+from typing import Generator, Callable, Any
+from contextlib import contextmanager, redirect_stdout
+
+import bsst
+
+
+class CapturedOutput(StringIO):
+    """Output captured by CaptureStdout(), to be checked by the test"""
 
 
 @contextmanager
 def CaptureStdout() -> Generator[StringIO, None, None]:
     save_stdout = sys.stdout
-    out = StringIO()
+    out = CapturedOutput()
     sys.stdout = out
     yield out
     sys.stdout = save_stdout
+
+
+@contextmanager
+def DropStdout() -> Generator[None, None, None]:
+    save_stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = save_stdout
+
+
+def report_maybe_dropped(keep_output: bool = False) -> None:
+    # The report is still produced to exercise the reporting code,
+    # but the output can be dropped to save on the output of
+    # thousands of reports when it is not needed for debugging.
+    # When the output is being captured, the test checks it, and it
+    # is always kept
+    if isinstance(sys.stdout, CapturedOutput):
+        keep_output = True
+
+    if os.getenv('BSST_TESTS_NO_REPORT_OUTPUT') and not keep_output:
+        with DropStdout():
+            bsst.report()
+    else:
+        bsst.report()
+        sys.stdout.flush()
+
+
+def get_num_workers() -> int:
+    # Tests can be run in parallel in worker processes. Each worker process
+    # has its own bsst environment and z3 context, so the tests that run
+    # in different workers do not affect each other
+    return int(os.getenv('BSST_TESTS_WORKERS') or 1)
+
+
+def run_captured(fn: Callable[..., Any], *args: Any) -> tuple[str, str]:
+    # Output of tests that run in parallel would be mixed together,
+    # so it is captured and returned to be printed in the main process,
+    # along with the error, if any. Plain StringIO is used rather than
+    # CaptureStdout(), because this output is not checked by the test,
+    # and reports in it can be dropped
+    error = ''
+    output = StringIO()
+    with redirect_stdout(output):
+        try:
+            fn(*args)
+        except BaseException:
+            error = traceback.format_exc()
+
+    return output.getvalue(), error
@@ -1,19 +1,23 @@
 #!/usr/bin/env python3
 
 import sys
+import difflib
+import multiprocessing
 
 from contextlib import contextmanager
 from typing import Generator, Any
 
 import bsst
 
-from test_util import CaptureStdout
+from test_util import CaptureStdout, get_num_workers, run_captured
 
 testcase: list[str] = []
 expected_result: list[str] = []
 expected_result_z3: list[str] = []
 settings: list[dict[str, Any]] = []
 
+SEPARATOR = '_' * 37
+
 tcstr = """DUP
 DUP
 DUP
@@ -351,22 +355,41 @@ def test(testno: int, expres: list[str]) -> None:
 
         if out != expres[testno]:
             print("NO MATCH")
-            print("_____________________________________")
+            print(SEPARATOR)
             print("Script:")
-            print("_____________________________________")
+            print(SEPARATOR)
             print(testcase[testno])
-            print("_____________________________________")
-            print("Expected:")
-            print("_____________________________________")
-            print(expres[testno])
-            print("_____________________________________")
-            print("Got:")
-            print("_____________________________________")
-            print(out)
-            print("_____________________________________")
+            print(SEPARATOR)
+            print("Diff:")
+            print(SEPARATOR)
+            sys.stdout.writelines(
+                difflib.unified_diff(expres[testno].splitlines(keepends=True),
+                                     out.splitlines(keepends=True),
+                                     fromfile='expected', tofile='got'))
+            print(SEPARATOR)
             sys.exit(-1)
 
 
+def test_in_worker(testno: int) -> tuple[str, str]:
+    return run_captured(test, testno, expected_result)
+
+
 if __name__ == '__main__':
-    for i in range(len(expected_result)):
-        test(i, expected_result)
+    num_workers = get_num_workers()
+
+    if num_workers <= 1:
+        for i in range(len(expected_result)):
+            test(i, expected_result)
+    else:
+        num_failed = 0
+        with multiprocessing.Pool(min(num_workers,
+                                      len(expected_result))) as pool:
+            for output, error in pool.imap(test_in_worker,
+                                           range(len(expected_result))):
+                print(output, end='')
+                if error:
+                    print(error)
+                    num_failed += 1
+
+        if num_failed:
+            sys.exit(-1)